@@ -0,0 +1,164 @@
+"""
+Cold start benchmark: import time of the main modules, and the heavy dependencies each
+import and each kind of run loads.
+
+Run from the repository root:
+    python -m benchmarks.bench_import --repeat 10
+"""
+
+import argparse
+import json
+import statistics
+import logging
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.bench_scraper import (
+    HtmlListingScraper,
+    JsonListingScraper,
+    stubbed_notifications,
+    write_searches,
+)
+from benchmarks.listing_server import ListingServer
+from shortener import IdentityBackend, UrlShortener
+
+MODULES = ["scraper", "notify", "email_errors", "runner", "scheduler"]
+# Dependencies that should only be loaded by the code paths needing them
+HEAVY = [
+    "arrow",
+    "bs4",
+    "keyring",
+    "lxml",
+    "mechanicalsoup",
+    "pyshorteners",
+    "requests",
+    "smtplib",
+    "sqlite3",
+    "yaml",
+]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "loaded": sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+"""
+
+# A run finding nothing new, the common case for cron driven scrapers, against the state
+# and server set up by the parent process
+RUN_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from benchmarks.bench_scraper import {scraper}
+scraper = {scraper}(**json.loads({kwargs!r}))
+scraper.main()
+scraper.close()
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "loaded": sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+"""
+
+
+def run_script(script: str) -> Dict[str, Any]:
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(name: str, script: str, repeat: int) -> Dict[str, Any]:
+    """
+    Run a script in `repeat` fresh interpreters.
+
+    :return: Median and best time, and the heavy modules loaded.
+    """
+    runs = [run_script(script) for _ in range(repeat)]
+    seconds = [run["seconds"] for run in runs]
+    return {
+        "name": name,
+        "median_ms": round(1000 * statistics.median(seconds), 1),
+        "best_ms": round(1000 * min(seconds), 1),
+        "loaded": runs[-1]["loaded"],
+    }
+
+
+def seed_state(
+    tmp: Path, server: ListingServer, mode: str, scraper_class: type
+) -> Dict[str, Any]:
+    """
+    Set up the files of a scraper, and store the elements of a first run.
+
+    :return: The scraper arguments, as JSON serializable values.
+    """
+    tmp.mkdir()
+    write_searches(tmp / "searches.yaml", server, mode, 1)
+    kwargs = {
+        "site_name": f"bench-{mode}",
+        "secrets_file": "",
+        "elements_out_file": str(tmp / "elements.json"),
+        "history_file": str(tmp / "history.txt"),
+        "searches_file": str(tmp / "searches.yaml"),
+        "email": "bench@example.com",
+        "json_request": mode == "json",
+        "error_history_file": str(tmp / "error_email.json"),
+        "search_cache_file": str(tmp / "searches_cache.json"),
+    }
+    scraper = scraper_class(
+        **kwargs,
+        logger=logging.getLogger("bench"),
+        shortener=UrlShortener(cache_file=None, backend=IdentityBackend()),
+    )
+    with stubbed_notifications(0):
+        scraper._run_scraper()
+    scraper.close()
+    return kwargs
+
+
+def report(result: Dict[str, Any], results: List[Dict[str, Any]]):
+    print(
+        f"{result['name']:<28} median={result['median_ms']:>7.1f}ms "
+        f"best={result['best_ms']:>7.1f}ms loaded: {', '.join(result['loaded']) or '-'}"
+    )
+    results.append(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--no-runs", action="store_true", help="Only time imports")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+
+    cases = [
+        (f"import {module}", IMPORT_SCRIPT.format(module=module, heavy=HEAVY))
+        for module in args.modules
+    ]
+    for name, script in cases:
+        report(measure(name, script, args.repeat), results)
+
+    if not args.no_runs:
+        with tempfile.TemporaryDirectory() as tmp_dir, ListingServer(latency=0, pages=1) as server:
+            for mode, scraper_class in (("json", JsonListingScraper), ("html", HtmlListingScraper)):
+                kwargs = seed_state(Path(tmp_dir) / mode, server, mode, scraper_class)
+                script = RUN_SCRIPT.format(
+                    scraper=scraper_class.__name__, kwargs=json.dumps(kwargs), heavy=HEAVY
+                )
+                report(measure(f"{mode} run, nothing new", script, args.repeat), results)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Logging throughput benchmark: time spent in logging calls by the logging threads, and
+until all records are written, with the handlers of default_logger (stdout, a DEBUG file
+and an INFO file), synchronous and in async mode with each overflow policy. Also times
+the formatters per record, against the earlier colored formatter copying each record.
+
+Run from the repository root:
+    python -m benchmarks.bench_logging --records 100000 --threads 4 --io-wait 0.005
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from copy import copy
+from typing import Any, Dict, List
+
+from my_logger import OVERFLOW_POLICIES, ColoredFormatter, MyLogger
+
+
+class CopyingColoredFormatter(logging.Formatter):
+    """
+    The earlier colored formatter, copying each record and building its colored level name
+    on every call. Kept as the baseline.
+    """
+
+    def format(self, record):
+        colored_record = copy(record)
+        levelname = colored_record.levelname
+        seq = ColoredFormatter.MAPPING.get(levelname, 37)
+        colored_record.levelname = ("{0}{1}m{2}{3}").format(
+            ColoredFormatter.PREFIX, seq, levelname, ColoredFormatter.SUFFIX
+        )
+        return logging.Formatter.format(self, colored_record)
+
+
+def make_logger(name: str, log_dir: str, async_mode: bool, queue_size: int, overflow: str):
+    """
+    Set up a logger like default_logger, with stdout going to /dev/null.
+
+    :return: The MyLogger object, and the devnull stream to close afterwards.
+    """
+    devnull = open(os.devnull, "w")
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        my_logger = (
+            MyLogger(
+                logger_name=name,
+                async_mode=async_mode,
+                queue_size=queue_size,
+                overflow=overflow,
+            )
+            .add_handler(level="INFO")
+            .add_handler(level="DEBUG", write_to_file=True, log_dir=log_dir)
+            .add_handler(level="INFO", write_to_file=True, log_dir=log_dir)
+        )
+    finally:
+        sys.stdout = stdout
+    return my_logger, devnull
+
+
+def log_records(logger, records: int, thread: int, io_wait: float):
+    # Mostly debug records, like the scrapers log per page and element, with a wait for a
+    # page every 50 records
+    for i in range(records):
+        if i % 50 == 0 and io_wait:
+            time.sleep(io_wait)
+        if i % 10 == 0:
+            logger.info("Processing page: %s", f"https://example.com/search?page={i}")
+        else:
+            logger.debug("Element %d of thread %d: %s", i, thread, {"id": i, "title": "x" * 40})
+
+
+def run_case(
+    name: str, async_mode: bool, overflow: str, args: argparse.Namespace
+) -> Dict[str, Any]:
+    """
+    Log `args.records` records from each of `args.threads` threads.
+
+    :return: Seconds in logging calls, seconds until written, records written and dropped.
+    """
+    waits = args.records // 50 * args.io_wait if args.io_wait else 0
+    with tempfile.TemporaryDirectory() as log_dir:
+        my_logger, devnull = make_logger(
+            f"bench_logging.{name}", log_dir, async_mode, args.queue_size, overflow
+        )
+        logger = my_logger.retrieve_logger()
+        threads = [
+            threading.Thread(target=log_records, args=(logger, args.records, i, args.io_wait))
+            for i in range(args.threads)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Time in logging calls, without the simulated page waits of each thread
+        calls = time.perf_counter() - start - waits
+        my_logger.stop()
+        written = time.perf_counter() - start
+        dropped = my_logger.dropped
+
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        devnull.close()
+        with open(os.path.join(log_dir, "DEBUG.log"), "rb") as fp:
+            lines = sum(1 for _ in fp)
+
+    total = args.records * args.threads
+    return {
+        "name": name,
+        "records": total,
+        "calls_s": round(calls, 4),
+        "us_per_call": round(1e6 * calls / total, 2),
+        "written_s": round(written, 4),
+        "records_written": lines,
+        "dropped": dropped,
+    }
+
+
+def time_formatters(records: int) -> List[Dict[str, Any]]:
+    """
+    Format DEBUG records with each formatter.
+
+    :return: Microseconds and bytes per record, by formatter.
+    """
+    formatters = {
+        "copying colored": CopyingColoredFormatter(MyLogger.FORMAT, MyLogger.DATE_FMT),
+        "colored": ColoredFormatter(MyLogger.FORMAT, MyLogger.DATE_FMT),
+        "plain (files)": MyLogger.FILE_FORMATTERS["plain"],
+        "json (files)": MyLogger.FILE_FORMATTERS["json"],
+    }
+    record = logging.LogRecord(
+        "bench", logging.DEBUG, __file__, 10, "Element %d: %s", (1, {"id": 1}), None, "run"
+    )
+    results = []
+    for name, formatter in formatters.items():
+        start = time.perf_counter()
+        for _ in range(records):
+            formatted = formatter.format(record)
+        seconds = time.perf_counter() - start
+        results.append(
+            {
+                "name": name,
+                "us_per_record": round(1e6 * seconds / records, 2),
+                "bytes_per_record": len(formatted.encode()) + 1,
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=50000, help="Records per thread")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument(
+        "--io-wait",
+        type=float,
+        default=0.0,
+        help="Seconds each thread waits for a page every 50 records, like a scraper",
+    )
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--no-handlers", action="store_true", help="Only time formatters")
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    for result in time_formatters(args.records):
+        print(
+            f"{result['name']:<18} {result['us_per_record']:>6.2f}us/record "
+            f"{result['bytes_per_record']:>4} bytes/record"
+        )
+        results.append(result)
+    if args.no_handlers:
+        cases = []
+    else:
+        cases = [("sync", False, "block")] + [
+            (f"async {overflow}", True, overflow) for overflow in OVERFLOW_POLICIES
+        ]
+
+    for name, async_mode, overflow in cases:
+        result = run_case(name.replace(" ", "_"), async_mode, overflow, args)
+        result["name"] = name
+        print(
+            f"{name:<18} calls={result['calls_s']:>8.3f}s ({result['us_per_call']:>6.2f}us/record) "
+            f"written={result['written_s']:>8.3f}s lines={result['records_written']:>8} "
+            f"dropped={result['dropped']}"
+        )
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
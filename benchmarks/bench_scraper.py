@@ -0,0 +1,287 @@
+"""
+Offline end-to-end benchmark of the Scraper pipeline, against the local listing server.
+
+Run from the repository root:
+    python -m benchmarks.bench_scraper --searches 8 --pages 5 --concurrency 1 4
+"""
+
+import argparse
+import json
+import logging
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List
+
+import notify
+from benchmarks.listing_server import ListingServer
+from scraper import Scraper
+from shortener import IdentityBackend, UrlShortener
+
+PHASES = ["fetch", "parse", "get_attrs", "compare", "notify"]
+
+
+class HtmlListingScraper(Scraper):
+    """
+    Reference scraper for the html listing pages.
+    """
+
+    PARSE_ONLY = {"name": ["ul", "nav"], "attrs": {"class": ["results", "pagination"]}}
+
+    def _get_elements(self, page):
+        return page.select("li.listing")
+
+    def _get_attrs(self, element, elmnts_dict, search):
+        link = element.find("a")
+        elmnts_dict[element["data-id"]] = {
+            "title": link.text,
+            "href": link["href"],
+            "price": element.find("span", class_="price").text,
+            "search": {
+                "name": search["search_title"],
+                "visit_url": search["display_url"],
+                "search_url": search["search_url"],
+            },
+        }
+        return elmnts_dict
+
+    def _get_next_page(self, page, page_url):
+        link = page.select_one("a.next")
+        if link is None:
+            return None
+        return page_url.split("/html/")[0] + link["href"]
+
+    def _ad_string_format(self, offer_link, search_link, offer_dict):
+        return f"{offer_link}, {offer_dict['price']} kr ({search_link})"
+
+
+class JsonListingScraper(Scraper):
+    """
+    Reference scraper for the JSON listing pages.
+    """
+
+    def _get_elements(self, page):
+        return page["docs"]
+
+    def _get_attrs(self, element, elmnts_dict, search):
+        elmnts_dict[element["id"]] = {
+            "title": element["title"],
+            "href": element["href"],
+            "price": element["price"],
+            "search": {
+                "name": search["search_title"],
+                "visit_url": search["display_url"],
+                "search_url": search["search_url"],
+            },
+        }
+        return elmnts_dict
+
+    def _get_next_page(self, page, page_url):
+        return page["next"]
+
+    def _ad_string_format(self, offer_link, search_link, offer_dict):
+        return f"{offer_link}, {offer_dict['price']} kr ({search_link})"
+
+
+class PhaseTimer:
+    """
+    Thread-safe accumulator of time spent per phase.
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.totals[name] += elapsed
+                self.counts[name] += 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {
+                "total_s": round(self.totals[name], 4),
+                "count": self.counts[name],
+                "mean_ms": round(1000 * self.totals[name] / self.counts[name], 3),
+            }
+            for name in PHASES
+            if self.counts[name]
+        }
+
+
+class TimedScraperMixin:
+    """
+    Times the phases of a Scraper run with the PhaseTimer in `self.timer`.
+    """
+
+    timer: PhaseTimer
+
+    def _request(self, *args, **kwargs):
+        with self.timer.phase("fetch"):
+            response = super()._request(*args, **kwargs)
+            # Include the body download, which requests otherwise defers to the parse phase
+            response.content
+            return response
+
+    def _load_page(self, response):
+        with self.timer.phase("parse"):
+            return super()._load_page(response)
+
+    def _get_attrs(self, element, elmnts_dict, search):
+        with self.timer.phase("get_attrs"):
+            return super()._get_attrs(element, elmnts_dict, search)
+
+    def _compare_results(self, cur_elements, *args, **kwargs):
+        with self.timer.phase("compare"):
+            return super()._compare_results(cur_elements, *args, **kwargs)
+
+    def _alert_write_new(self, elements, searches):
+        with self.timer.phase("notify"):
+            return super()._alert_write_new(elements, searches)
+
+
+class TimedHtmlListingScraper(TimedScraperMixin, HtmlListingScraper):
+    pass
+
+
+class TimedJsonListingScraper(TimedScraperMixin, JsonListingScraper):
+    pass
+
+
+@contextmanager
+def stubbed_notifications(latency: float):
+    """
+    Replace the Pushover and email senders with stubs sleeping for `latency` seconds.
+    """
+    originals = notify.push_notification, notify.mail
+    notify.push_notification = lambda *args, **kwargs: time.sleep(latency)
+    notify.mail = lambda *args, **kwargs: time.sleep(latency)
+    try:
+        yield
+    finally:
+        notify.push_notification, notify.mail = originals
+
+
+def write_searches(filename: Path, server: ListingServer, mode: str, searches: int):
+    lines = ["searches:"]
+    for i in range(searches):
+        lines.append(f"  - search_url: {server.search_url(mode, f's{i}')}")
+        lines.append(f"    title: Search {i}")
+    filename.write_text("\n".join(lines) + "\n")
+
+
+def run_case(
+    mode: str, server: ListingServer, args: argparse.Namespace, concurrency: int
+) -> List[Dict[str, Any]]:
+    """
+    Run a scraper three times against the server: a first run where everything is new, a
+    run where one listing per page has changed, and a run where nothing has changed.
+
+    :return: One result per run.
+    """
+    results = []
+    scraper_class = TimedHtmlListingScraper if mode == "html" else TimedJsonListingScraper
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp = Path(tmp_dir)
+        write_searches(tmp / "searches.yaml", server, mode, args.searches)
+        scraper = scraper_class(
+            site_name=f"bench-{mode}",
+            secrets_file="",
+            elements_out_file=str(tmp / f"elements{args.store_suffix}"),
+            history_file=str(tmp / "history.txt"),
+            searches_file=str(tmp / "searches.yaml"),
+            email="bench@example.com",
+            json_request=mode == "json",
+            logger=logging.getLogger("bench"),
+            concurrency=concurrency,
+            shortener=UrlShortener(cache_file=None, backend=IdentityBackend()),
+            validators_file=str(tmp / "validators.json") if args.conditional else None,
+            streaming_diff=args.streaming,
+            error_history_file=str(tmp / "error_email.json"),
+            search_cache_file=str(tmp / "searches_cache.json"),
+        )
+        for run, version in (("first", 0), ("changed", 1), ("same", 1)):
+            server.version = version
+            requests_before = server.requests
+            bytes_before = server.bytes_sent
+            scraper.timer = PhaseTimer()
+            start = time.perf_counter()
+            with stubbed_notifications(args.notify_latency):
+                scraper._run_scraper()
+            wall = time.perf_counter() - start
+            items = args.searches * args.pages * args.items
+            results.append(
+                {
+                    "mode": mode,
+                    "run": run,
+                    "concurrency": concurrency,
+                    "wall_s": round(wall, 4),
+                    "items_per_s": round(items / wall, 1),
+                    "requests": server.requests - requests_before,
+                    "bytes": server.bytes_sent - bytes_before,
+                    "phases": scraper.timer.summary(),
+                }
+            )
+        scraper.close()
+    return results
+
+
+def print_result(result: Dict[str, Any]):
+    print(
+        f"{result['mode']:>4} {result['run']:>7} c={result['concurrency']:<3} "
+        f"wall={result['wall_s']:.3f}s items/s={result['items_per_s']:<9} "
+        f"requests={result['requests']} bytes={result['bytes']}"
+    )
+    for name, phase in result["phases"].items():
+        print(
+            f"      {name:<10} total={phase['total_s']:.4f}s "
+            f"count={phase['count']:<6} mean={phase['mean_ms']:.3f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=["html", "json"], choices=["html", "json"])
+    parser.add_argument("--searches", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--items", type=int, default=50, help="Listings per page")
+    parser.add_argument("--padding", type=int, default=2000, help="Filler bytes per listing")
+    parser.add_argument("--latency", type=float, default=0.05, help="Server latency in seconds")
+    parser.add_argument("--notify-latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--store-suffix", default=".json", help=".json or .db")
+    parser.add_argument("--conditional", action="store_true", help="Use the validator cache")
+    parser.add_argument("--streaming", action="store_true", help="Use streaming diff")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    with ListingServer(
+        latency=args.latency,
+        pages=args.pages,
+        items_per_page=args.items,
+        padding=args.padding,
+    ) as server:
+        for mode in args.modes:
+            for concurrency in args.concurrency:
+                for result in run_case(mode, server, args, concurrency):
+                    print_result(result)
+                    results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Local HTTP stand-in for listing sites. Serves synthetic, paginated search results as
+html or JSON, with configurable latency, page size and item count.
+
+Routes:
+    /html/<search>?page=N   html listing page, with a link to the next page
+    /json/<search>?page=N   JSON listing page, with a "next" URL
+"""
+
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class ListingServer:
+    """
+    Threaded HTTP server serving synthetic listing pages. Use as a context manager, or
+    call start() and stop().
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        pages: int = 5,
+        items_per_page: int = 50,
+        padding: int = 2000,
+        version: int = 0,
+    ):
+        """
+        :param latency: Seconds to wait before answering each request.
+        :param pages: Number of result pages per search.
+        :param items_per_page: Number of listings per page.
+        :param padding: Bytes of filler markup per listing, to simulate realistic page sizes.
+        :param version: Listing content version. Changing it changes one listing per page.
+        """
+        self.latency = latency
+        self.pages = pages
+        self.items_per_page = items_per_page
+        self.padding = padding
+        self.version = version
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def search_url(self, mode: str, search: str) -> str:
+        """
+        Get the URL of the first page of a search.
+
+        :param mode: "html" or "json".
+        :param search: Name of the search.
+        :return: The URL.
+        """
+        return f"{self.base_url}/{mode}/{search}?page=1"
+
+    def _items(self, search: str, page: int):
+        for i in range(self.items_per_page):
+            item_id = f"{search}-{page}-{i}"
+            # The first listing of each page changes with the version
+            price = 1000 + i + (self.version if i == 0 else 0)
+            yield {
+                "id": item_id,
+                "title": f"Listing {item_id}",
+                "price": price,
+                "href": f"{self.base_url}/item/{item_id}",
+            }
+
+    def _html_page(self, search: str, page: int) -> bytes:
+        filler = "<span class='filler'>" + "x" * self.padding + "</span>"
+        items = "".join(
+            f"<li class='listing' data-id='{item['id']}'>"
+            f"<a href='{item['href']}'>{item['title']}</a>"
+            f"<span class='price'>{item['price']}</span>{filler}</li>"
+            for item in self._items(search, page)
+        )
+        next_link = (
+            f"<a class='next' href='/html/{search}?page={page + 1}'>Neste</a>"
+            if page < self.pages
+            else ""
+        )
+        return (
+            "<!DOCTYPE html><html><head><title>Listings</title></head><body>"
+            f"<header>{filler * 5}</header>"
+            f"<ul class='results'>{items}</ul>"
+            f"<nav class='pagination'>{next_link}</nav>"
+            f"<footer>{filler * 5}</footer></body></html>"
+        ).encode()
+
+    def _json_page(self, search: str, page: int) -> bytes:
+        next_url = (
+            f"{self.base_url}/json/{search}?page={page + 1}" if page < self.pages else None
+        )
+        return json.dumps(
+            {
+                "docs": [
+                    dict(item, description="x" * self.padding)
+                    for item in self._items(search, page)
+                ],
+                "next": next_url,
+            }
+        ).encode()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes, which Nagle's algorithm holds
+            # back until the client's delayed ACK on kept-alive connections
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                parts = url.path.strip("/").split("/")
+                page = int(parse_qs(url.query).get("page", ["1"])[0])
+                time.sleep(server.latency)
+
+                if len(parts) != 2 or parts[0] not in ("html", "json"):
+                    self.send_error(404)
+                    return
+                mode, search = parts
+                if mode == "html":
+                    body = server._html_page(search, page)
+                    content_type = "text/html; charset=utf-8"
+                else:
+                    body = server._json_page(search, page)
+                    content_type = "application/json"
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+
+                with server._lock:
+                    server.requests += 1
+                    if self.headers.get("If-None-Match") == etag:
+                        server.not_modified += 1
+                    else:
+                        server.bytes_sent += len(body)
+
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    with ListingServer() as listing_server:
+        print(f"Serving on {listing_server.base_url}, e.g. {listing_server.search_url('html', 'demo')}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,129 @@
+"""
+Local Pushover API stand-in. Accepts any token and user key, without encryption, and
+counts connections, requests and messages. Sends the app limit headers of the real API,
+and answers 429 once the limit is used up.
+
+Use with PushoverClient(token, user_key, endpoint=server.endpoint).
+"""
+
+import http.server
+import threading
+import time
+from typing import List, Optional
+from urllib.parse import parse_qs
+
+
+class PushoverServer:
+    """
+    Threaded Pushover API server, for tests and benchmarks. Use as a context manager, or
+    call start() and stop().
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        limit: int = 10000,
+        remaining: Optional[int] = None,
+        reset: Optional[int] = None,
+        keep_alive: bool = True,
+        idle_timeout: Optional[float] = None,
+    ):
+        """
+        :param latency: Seconds to wait before answering each request.
+        :param limit: The monthly message limit of the app.
+        :param remaining: Messages left this month. Defaults to `limit`.
+        :param reset: Time the limit resets, as a unix timestamp. Defaults to in 30 days.
+        :param keep_alive: Keep connections open between requests.
+        :param idle_timeout: Close connections idle for this many seconds.
+        """
+        self.latency = latency
+        self.limit = limit
+        self.remaining = limit if remaining is None else remaining
+        self.reset = reset or int(time.time()) + 30 * 24 * 3600
+        self.keep_alive = keep_alive
+        self.idle_timeout = idle_timeout
+        self.connections = 0
+        self.requests = 0
+        # The message text of each accepted message
+        self.messages: List[str] = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/1/messages.json"
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" if server.keep_alive else "HTTP/1.0"
+            timeout = server.idle_timeout
+            # Headers and body go out in separate writes, which Nagle's algorithm holds
+            # back until the client's delayed ACK on kept-alive connections
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                time.sleep(server.latency)
+                length = int(self.headers.get("Content-Length", 0))
+                fields = parse_qs(self.rfile.read(length).decode())
+                with server._lock:
+                    server.requests += 1
+                    if not fields.get("token") or not fields.get("user"):
+                        status, body = 400, b'{"status":0,"errors":["token and user required"]}'
+                    elif server.remaining <= 0:
+                        status, body = 429, b'{"status":0,"errors":["limit reached"]}'
+                    elif len(fields.get("message", [""])[0]) > 1024:
+                        status, body = 400, b'{"status":0,"errors":["message too long"]}'
+                    else:
+                        server.remaining -= 1
+                        server.messages.append(fields["message"][0])
+                        status, body = 200, b'{"status":1}'
+                    remaining = server.remaining
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("X-Limit-App-Limit", str(server.limit))
+                self.send_header("X-Limit-App-Remaining", str(remaining))
+                self.send_header("X-Limit-App-Reset", str(server.reset))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    with PushoverServer() as pushover_server:
+        print(f"Serving the Pushover API on {pushover_server.endpoint}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,157 @@
+"""
+Local SMTP stand-in. Accepts any login and any message, without encryption, and counts
+connections, logins, messages and bytes. Can refuse recipients and drop connections, to
+exercise error handling and reconnects.
+
+Use with Mailer(sender, password, host="127.0.0.1", port=server.port, tls="none").
+"""
+
+import socketserver
+import threading
+import time
+from typing import List, Optional, Tuple
+
+
+class SmtpServer:
+    """
+    Threaded SMTP server, for tests and benchmarks. Use as a context manager, or call
+    start() and stop().
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        refuse: Tuple[str, ...] = (),
+        drop_after: Optional[int] = None,
+        keep_messages: bool = True,
+    ):
+        """
+        :param latency: Seconds to wait before answering each command.
+        :param refuse: Recipients to refuse.
+        :param drop_after: Close each connection after this many messages.
+        :param keep_messages: Keep the received messages in `messages`.
+        """
+        self.latency = latency
+        self.refuse = refuse
+        self.drop_after = drop_after
+        self.keep_messages = keep_messages
+        self.connections = 0
+        self.logins = 0
+        self.noops = 0
+        self.message_count = 0
+        self.bytes_received = 0
+        # (sender, recipients, message) of each received message
+        self.messages: List[Tuple[str, List[str], bytes]] = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str):
+                time.sleep(server.latency)
+                self.wfile.write(line.encode() + b"\r\n")
+
+            def handle(self):
+                with server._lock:
+                    server.connections += 1
+                sender, recipients, received = None, [], 0
+                self.reply("220 localhost SMTP stand-in")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode(errors="replace").strip()
+                    verb = command.split(" ", 1)[0].upper()
+                    if verb == "EHLO":
+                        self.wfile.write(b"250-localhost\r\n250-AUTH PLAIN LOGIN\r\n")
+                        self.reply("250 8BITMIME")
+                    elif verb == "HELO":
+                        self.reply("250 localhost")
+                    elif verb == "AUTH":
+                        if command.upper().startswith("AUTH LOGIN"):
+                            self.reply("334 VXNlcm5hbWU6")
+                            self.rfile.readline()
+                            self.reply("334 UGFzc3dvcmQ6")
+                            self.rfile.readline()
+                        with server._lock:
+                            server.logins += 1
+                        self.reply("235 Authenticated")
+                    elif verb == "MAIL":
+                        sender, recipients = command[10:].strip("<> "), []
+                        self.reply("250 OK")
+                    elif verb == "RCPT":
+                        recipient = command[8:].strip("<> ")
+                        if recipient in server.refuse:
+                            self.reply("550 Recipient refused")
+                        else:
+                            recipients.append(recipient)
+                            self.reply("250 OK")
+                    elif verb == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = bytearray()
+                        while True:
+                            data_line = self.rfile.readline()
+                            if not data_line or data_line == b".\r\n":
+                                break
+                            if data_line.startswith(b".."):
+                                data_line = data_line[1:]
+                            if server.keep_messages:
+                                data += data_line
+                            with server._lock:
+                                server.bytes_received += len(data_line)
+                        with server._lock:
+                            server.message_count += 1
+                            if server.keep_messages:
+                                server.messages.append((sender, recipients, bytes(data)))
+                        received += 1
+                        self.reply("250 OK")
+                        if server.drop_after and received >= server.drop_after:
+                            return
+                    elif verb == "NOOP":
+                        with server._lock:
+                            server.noops += 1
+                        self.reply("250 OK")
+                    elif verb == "RSET":
+                        sender, recipients = None, []
+                        self.reply("250 OK")
+                    elif verb == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        return Handler
+
+    def start(self):
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    with SmtpServer() as smtp_server:
+        print(f"Serving SMTP on 127.0.0.1:{smtp_server.port}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
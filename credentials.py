@@ -0,0 +1,332 @@
+import logging
+import os
+import platform
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Names of the credentials used by the notifications
+EMAIL_PASSWORD = "email_password"
+PUSHOVER_TOKEN = "pushover_token"
+PUSHOVER_USER_KEY = "pushover_user_key"
+
+logger = logging.getLogger(__name__)
+
+
+class CredentialNotFound(Exception):
+    """Raised when none of the backends of a provider has a credential."""
+
+    pass
+
+
+class CredentialBackend(ABC):
+    """
+    An abstract base class for places to look credentials up in.
+    """
+
+    @abstractmethod
+    def get(self, name: str) -> Optional[str]:
+        """
+        Look up a credential.
+
+        :param name: The name of the credential, like EMAIL_PASSWORD.
+        :return: The value, or None if the backend does not have the credential.
+        """
+        pass
+
+    def invalidate(self):
+        """
+        Forget memoized values, so they are looked up again.
+        """
+        pass
+
+
+# Marks a watched file as not read yet
+_UNREAD = object()
+
+
+class _WatchedFile:
+    """
+    The parsed content of a file, read again only when its mtime or size changes.
+    """
+
+    def __init__(self, path: str, parse: Callable[[str], Any]):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.parse = parse
+        self._key: Any = _UNREAD
+        self._value: Any = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        """
+        :return: The parsed content, or None if the file does not exist.
+        """
+        try:
+            stat = os.stat(self.path)
+            key = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            key = None
+        with self._lock:
+            if key != self._key:
+                value = None
+                if key is not None:
+                    with open(self.path, "r") as fp:
+                        value = self.parse(fp.read())
+                self._key, self._value = key, value
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._key = _UNREAD
+
+
+class FileBackend(CredentialBackend):
+    """
+    A file holding one credential, like a password file.
+    """
+
+    def __init__(self, path: str, name: str = EMAIL_PASSWORD):
+        """
+        :param path: Path to the file.
+        :param name: The name of the credential in the file.
+        """
+        self.name = name
+        # A trailing line break is not part of the credential
+        self._file = _WatchedFile(path, lambda content: content.rstrip("\r\n"))
+
+    def get(self, name: str) -> Optional[str]:
+        if name != self.name:
+            return None
+        return self._file.get()
+
+    def invalidate(self):
+        self._file.invalidate()
+
+    def __str__(self) -> str:
+        return f"file {self._file.path}"
+
+
+class YamlBackend(CredentialBackend):
+    """
+    A YAML file mapping credential names to values, like the secrets file.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path to the file.
+        """
+        self._file = _WatchedFile(path, self._parse)
+
+    @staticmethod
+    def _parse(content: str) -> Dict[str, Any]:
+        import yaml
+
+        return yaml.safe_load(content) or {}
+
+    def get(self, name: str) -> Optional[str]:
+        value = (self._file.get() or {}).get(name)
+        return None if value is None else str(value)
+
+    def invalidate(self):
+        self._file.invalidate()
+
+    def __str__(self) -> str:
+        return f"YAML file {self._file.path}"
+
+
+class EnvBackend(CredentialBackend):
+    """
+    Environment variables, named after the credentials in upper case, like EMAIL_PASSWORD.
+    Not memoized, as looking them up is cheap.
+    """
+
+    def __init__(self, prefix: str = ""):
+        """
+        :param prefix: Prefix of the variable names.
+        """
+        self.prefix = prefix
+
+    def _variable(self, name: str) -> str:
+        return f"{self.prefix}{name.upper()}"
+
+    def get(self, name: str) -> Optional[str]:
+        return os.environ.get(self._variable(name)) or None
+
+    def __str__(self) -> str:
+        return f"environment variables {self.prefix}*"
+
+
+class KeyringBackend(CredentialBackend):
+    """
+    A credential in the system keyring, like the macOS keychain. Memoized for the rest of
+    the process, as keyring lookups are slow and may prompt the user.
+    """
+
+    def __init__(self, service: Optional[str], username: str, name: str = EMAIL_PASSWORD):
+        """
+        :param service: The keyring service, like a keychain item name.
+        :param username: The username of the credential in the service.
+        :param name: The name of the credential.
+        """
+        self.service = service
+        self.username = username
+        self.name = name
+        self._value: Any = _UNREAD
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[str]:
+        if name != self.name:
+            return None
+        with self._lock:
+            if self._value is _UNREAD:
+                import keyring
+
+                try:
+                    self._value = keyring.get_password(self.service, self.username)
+                except Exception as e:
+                    logger.error(f"Failed to retrieve password from keyring: {e}")
+                    raise
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = _UNREAD
+
+    def __str__(self) -> str:
+        return f"keyring {self.service}/{self.username}"
+
+
+class CredentialProvider:
+    """
+    Looks credentials up in a list of backends, in order. The first backend having a
+    credential wins.
+    """
+
+    def __init__(self, backends: List[CredentialBackend]):
+        """
+        :param backends: The backends, in order of precedence.
+        """
+        self.backends = backends
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """
+        Look up a credential.
+
+        :param name: The name of the credential.
+        :param default: The value if no backend has the credential.
+        :return: The value.
+        """
+        for backend in self.backends:
+            value = backend.get(name)
+            if value is not None:
+                return value
+        return default
+
+    def require(self, name: str) -> str:
+        """
+        Look up a credential that must exist.
+
+        :param name: The name of the credential.
+        :return: The value.
+        :raise CredentialNotFound: If no backend has the credential.
+        """
+        value = self.get(name)
+        if value is None:
+            places = ", ".join(str(backend) for backend in self.backends) or "no backends"
+            logger.error(f"No {name} found in {places}")
+            raise CredentialNotFound(f"No {name} found in {places}")
+        return value
+
+    def invalidate(self):
+        """
+        Forget the memoized values of all backends, e.g. after a credential was rejected.
+        """
+        for backend in self.backends:
+            backend.invalidate()
+
+
+_providers: Dict[Tuple, CredentialProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def _shared_provider(
+    key: Tuple, backends: Callable[[], List[CredentialBackend]]
+) -> CredentialProvider:
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            provider = CredentialProvider(backends())
+            _providers[key] = provider
+    return provider
+
+
+def email_provider(
+    sender_email: str, pwd_file: Optional[str] = None, keychain_name: Optional[str] = None
+) -> CredentialProvider:
+    """
+    Get the provider of the password of an email account, shared by the whole process.
+    The password is looked up in the password file, the EMAIL_PASSWORD environment
+    variable, and on macOS in the keychain.
+
+    :param sender_email: The email account.
+    :param pwd_file: File holding the password.
+    :param keychain_name: Keychain service holding the password.
+    :return: The provider.
+    """
+
+    def backends() -> List[CredentialBackend]:
+        found: List[CredentialBackend] = []
+        if pwd_file:
+            found.append(FileBackend(pwd_file, EMAIL_PASSWORD))
+        found.append(EnvBackend())
+        if platform.system() == "Darwin":  # Macos
+            found.append(KeyringBackend(keychain_name, sender_email, EMAIL_PASSWORD))
+        return found
+
+    return _shared_provider(("email", sender_email, pwd_file, keychain_name), backends)
+
+
+def pushover_provider(secrets_file: Optional[str] = None) -> CredentialProvider:
+    """
+    Get the provider of Pushover credentials, shared by the whole process. The credentials
+    are looked up in the secrets file, and in the PUSHOVER_TOKEN and PUSHOVER_USER_KEY
+    environment variables.
+
+    :param secrets_file: YAML file with pushover_token and pushover_user_key.
+    :return: The provider.
+    """
+    path = os.path.abspath(secrets_file) if secrets_file else None
+
+    def backends() -> List[CredentialBackend]:
+        found: List[CredentialBackend] = []
+        if path:
+            found.append(YamlBackend(path))
+        found.append(EnvBackend())
+        return found
+
+    return _shared_provider(("pushover", path), backends)
+
+
+def pushover_credentials(
+    token: Optional[str] = None,
+    user_key: Optional[str] = None,
+    secrets_file: Optional[str] = None,
+) -> Tuple[str, str]:
+    """
+    Resolve the Pushover credentials. The secrets file and environment variables take
+    precedence over the given token and user key.
+
+    :param token: The app token.
+    :param user_key: The user key.
+    :param secrets_file: YAML file with the credentials.
+    :return: The token and the user key.
+    :raise CredentialNotFound: If the token or the user key is missing.
+    """
+    provider = pushover_provider(secrets_file)
+    token = provider.get(PUSHOVER_TOKEN, token)
+    user_key = provider.get(PUSHOVER_USER_KEY, user_key)
+    if not token or not user_key:
+        raise CredentialNotFound(
+            "The secrets.yaml file does not exist and/or pushover credentials are not provided."
+        )
+    return token, user_key
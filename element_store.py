@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional, Set
+
+from i_o_utilities import create_files, write_json_atomic
+
+# Only needed by the SQLite backend, so imported where it is used
+if TYPE_CHECKING:
+    import sqlite3
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+# Stay well below SQLite's limit on the number of query parameters
+SQLITE_BATCH_SIZE = 500
+
+
+class ElementStore(ABC):
+    """
+    An abstract base class for the stored state of a scraper: the elements found on the
+    last run, by key. Each element belongs to a scope, the URL of the search it was found by.
+    """
+
+    @staticmethod
+    def scope_of(element: Any) -> Optional[str]:
+        """
+        Get the scope of an element.
+
+        :param element: The element.
+        :return: The search URL of the element, or None if it has none.
+        """
+        try:
+            return element["search"]["search_url"]
+        except (KeyError, TypeError):
+            return None
+
+    @abstractmethod
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Look up stored elements.
+
+        :param keys: The keys to look up.
+        :return: The stored elements for the keys that exist.
+        """
+        pass
+
+    @abstractmethod
+    def keys(self, scope: Optional[str] = None) -> Set[str]:
+        """
+        Get the stored keys.
+
+        :param scope: Only return keys in this scope. All keys if None.
+        :return: The set of keys.
+        """
+        pass
+
+    @abstractmethod
+    def scopes(self) -> Set[Optional[str]]:
+        """
+        Get the scopes of the stored elements.
+
+        :return: The set of scopes.
+        """
+        pass
+
+    @abstractmethod
+    def write(self, upserts: Dict[str, Any], deletes: Iterable[str]):
+        """
+        Insert or replace elements and delete keys, as one atomic change.
+
+        :param upserts: The elements to insert or replace, by key.
+        :param deletes: The keys to delete.
+        """
+        pass
+
+    def close(self):
+        """
+        Release resources held by the store.
+        """
+        pass
+
+
+class JsonElementStore(ElementStore):
+    """
+    Element store keeping all elements in one JSON file, which is rewritten on change.
+    The file is read once and kept in memory for as long as it is not modified by others.
+    """
+
+    def __init__(self, filename: str):
+        """
+        :param filename: Path to the JSON file.
+        """
+        self.filename = filename
+        self._elements: Optional[Dict[str, Any]] = None
+        self._mtime = None
+        self._lock = threading.RLock()
+
+    def _load(self) -> Dict[str, Any]:
+        corrupt_file = f"{self.filename}.corrupt"
+        if os.path.exists(corrupt_file):
+            # Starting empty would report every element as new
+            raise IOError(
+                f"Stored elements were unreadable and moved to {corrupt_file}. "
+                "Repair and move it back, or remove it to start over."
+            )
+        create_files(self.filename)
+        mtime = os.stat(self.filename).st_mtime_ns
+        if self._elements is not None and mtime == self._mtime:
+            return self._elements
+
+        elements = {}
+        with open(self.filename, "r") as fp:
+            if fp.read() != "":
+                fp.seek(0)
+                try:
+                    elements = json.load(fp)
+                except ValueError as e:
+                    # Kept for repair, instead of losing the state
+                    os.replace(self.filename, corrupt_file)
+                    raise IOError(
+                        f"Could not read json. Moved it to {corrupt_file}."
+                    ) from e
+        self._elements = elements
+        self._mtime = mtime
+        return elements
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        with self._lock:
+            elements = self._load()
+            return {key: elements[key] for key in keys if key in elements}
+
+    def keys(self, scope: Optional[str] = None) -> Set[str]:
+        with self._lock:
+            elements = self._load()
+            if scope is None:
+                return set(elements)
+            return {
+                key
+                for key, element in elements.items()
+                if self.scope_of(element) == scope
+            }
+
+    def scopes(self) -> Set[Optional[str]]:
+        with self._lock:
+            return {self.scope_of(element) for element in self._load().values()}
+
+    def write(self, upserts: Dict[str, Any], deletes: Iterable[str]):
+        with self._lock:
+            elements = self._load()
+            deletes = [key for key in deletes if key in elements]
+            if not upserts and not deletes:
+                return
+            elements.update(upserts)
+            for key in deletes:
+                del elements[key]
+            write_json_atomic(self.filename, elements)
+            self._mtime = os.stat(self.filename).st_mtime_ns
+
+
+class SqliteElementStore(ElementStore):
+    """
+    Element store backed by an SQLite database, with the elements indexed by key and scope.
+    Only changed elements are written, in a single transaction.
+    """
+
+    def __init__(self, filename: str):
+        """
+        :param filename: Path to the database file.
+        """
+        self.filename = filename
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            import sqlite3
+
+            create_files(self.filename)
+            conn = sqlite3.connect(self.filename, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS elements "
+                    "(key TEXT PRIMARY KEY, scope TEXT, value TEXT NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS elements_scope ON elements (scope)"
+                )
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            for i in range(0, len(keys), SQLITE_BATCH_SIZE):
+                batch = keys[i : i + SQLITE_BATCH_SIZE]
+                rows = conn.execute(
+                    "SELECT key, value FROM elements WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch,
+                )
+                found.update((key, json.loads(value)) for key, value in rows)
+        return found
+
+    def keys(self, scope: Optional[str] = None) -> Set[str]:
+        with self._lock:
+            conn = self._connect()
+            if scope is None:
+                rows = conn.execute("SELECT key FROM elements")
+            else:
+                rows = conn.execute("SELECT key FROM elements WHERE scope = ?", (scope,))
+            return {key for (key,) in rows}
+
+    def scopes(self) -> Set[Optional[str]]:
+        with self._lock:
+            rows = self._connect().execute("SELECT DISTINCT scope FROM elements")
+            return {scope for (scope,) in rows}
+
+    def write(self, upserts: Dict[str, Any], deletes: Iterable[str]):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO elements (key, scope, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE "
+                    "SET scope = excluded.scope, value = excluded.value",
+                    (
+                        (key, self.scope_of(element), json.dumps(element))
+                        for key, element in upserts.items()
+                    ),
+                )
+                conn.executemany(
+                    "DELETE FROM elements WHERE key = ?", ((key,) for key in deletes)
+                )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def open_element_store(filename: str) -> ElementStore:
+    """
+    Open the element store matching a file name: SQLite for .db, .sqlite and .sqlite3 files,
+    else JSON.
+
+    :param filename: Path to the store.
+    :return: The element store.
+    """
+    if filename.endswith(SQLITE_SUFFIXES):
+        return SqliteElementStore(filename)
+    return JsonElementStore(filename)
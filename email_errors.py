@@ -1,7 +1,7 @@
 import json
-import arrow
 import notify
 import os
+import socket
 from my_logger import default_logger
 
 from i_o_utilities import create_files
@@ -10,7 +10,6 @@ from i_o_utilities import create_files
 # Then error summary on day 3, then day 7 etc.
 
 SEND_INTERVALS = [0, 1, 2, 4, 7, 15]
-NOW = arrow.now()
 
 class NoInternetError(OSError):
     """Raised when there is no internet connection."""
@@ -23,11 +22,26 @@ def email_errors(
     history_file="error_email.json",
     logger=None,
     log_file=None,
+    sender_email=None,
+    pwd_file=None,
+    keychain_name=None,
 ):
+    """
+    Record an error, and email it when the send interval has passed. Resets the history
+    if there is no error.
+
+    :param sender_email: The account to send from. Defaults to `email`.
+    :param pwd_file: File holding the password of the sending account.
+    :param keychain_name: Keychain service holding the password, if there is no pwd_file.
+    """
     log_file_path = [os.path.abspath(log_file)] if log_file else []
-    log = logger or default_logger(log_file=log_file)
+    log = logger or default_logger(
+        log_dir=os.path.dirname(os.path.abspath(log_file)) if log_file else "."
+    )
 
     create_files(history_file)
+    # Only needed when there is a history or an error to record
+    now = None
 
     with open(history_file, "r+") as fp:
         try:
@@ -46,14 +60,21 @@ def email_errors(
                 log.info("Non-empty file with history of sending and errors")
                 dates = json.loads(fp_content)
                 if dates["error_sent"]:
+                    import arrow
+
+                    now = arrow.now()
                     last_send_date = arrow.get(dates["error_sent"][-1])
-                    days_since_send = (NOW - last_send_date).days
+                    days_since_send = (now - last_send_date).days
 
             if exception is None:
                 log.info("No exception provided, resetting error log.")
                 dates = {"error": [], "error_sent": []}
             else:
-                dates["error"].append(NOW.format())
+                if now is None:
+                    import arrow
+
+                    now = arrow.now()
+                dates["error"].append(now.format())
 
                 next_send_limit = SEND_INTERVALS[
                     -1
@@ -62,7 +83,7 @@ def email_errors(
                 if num_sent < len(SEND_INTERVALS):
                     next_send_limit = SEND_INTERVALS[num_sent]
 
-                if has_internet():
+                if not has_internet():
                     raise NoInternetError(
                         "No internet connection."
                     )
@@ -78,10 +99,16 @@ def email_errors(
                             f"Feilmelding: {exception}"
                         )
                         notify.mail(
-                            email, "Feil under kjøring av skript", body, log_file_path
+                            email,
+                            "Feil under kjøring av skript",
+                            body,
+                            sender_email or email,
+                            files=log_file_path,
+                            pwd_file=pwd_file,
+                            keychain_name=keychain_name,
                         )
                         log.info("Email sent. Appending to list.")
-                        dates["error_sent"].append(NOW.format())
+                        dates["error_sent"].append(now.format())
                     except Exception as e:
                         # Exit before marking as send if error on send. Make sure fp is not corrupted.
                         log.error(f"Could not send email. Error:{e}")
@@ -94,14 +121,20 @@ def email_errors(
             fp.truncate()  # Truncate the file to remove any leftover data
             log.info("Dumping updated dates to json")
             json.dump(dates, fp)
+        except NoInternetError as e:
+            # A subclass of OSError, so caught first. Keep the history, with this error
+            # recorded as not sent, so it is sent once the connection is back.
+            log.error(f"Could not send email due to no internet connection. Exiting with code 0 to avoid cronjob send. Error: {e}")
+            fp.seek(0)
+            fp.truncate()
+            json.dump(dates, fp)
+            fp.close()
+            exit(0)
         except (FileNotFoundError, PermissionError, IsADirectoryError, OSError) as e:
             log.error(f"Could not read or process the file. Error: {e}")
             fp.seek(0)
             fp.truncate()  # Clear the file contents
             raise IOError("Could not read or process the file.") from e
-        except NoInternetError as e:
-            log.error(f"Could not send email due to no internet connection. Exiting with code 0 to avoid cronjob send. Error: {e}")
-            exit(0)
 
 
 def has_internet(host="1.1.1.1", port=53, timeout=2):
@@ -109,10 +142,10 @@ def has_internet(host="1.1.1.1", port=53, timeout=2):
     Checks internet connectivity by attempting to connect to a public DNS server (Cloudflare).
     """
     try:
-        socket.setdefaulttimeout(timeout)
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
+        # A timeout for this connection only, not the process-wide default
+        socket.create_connection((host, port), timeout=timeout).close()
         return True
-    except socket.error:
+    except OSError:
         return False
 
 if __name__ == "__main__":
@@ -0,0 +1,300 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, FrozenSet, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from metrics import NULL_METRICS, RunMetrics
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Statuses telling the client to slow down
+THROTTLE_STATUSES = frozenset({429, 503})
+# Errors worth another attempt. Other request errors, like invalid URLs, fail at once.
+RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+# Lowest fraction of the configured rate the adaptive rate limit goes down to
+MIN_RATE_FACTOR = 1 / 16
+
+
+class FetchError(Exception):
+    """Raised when a page could not be fetched, after retries."""
+
+    def __init__(self, url: str, message: str):
+        super().__init__(f"Could not fetch {url}: {message}")
+        self.url = url
+
+
+class HostSkipped(FetchError):
+    """Raised for requests to a host skipped for the rest of the run by the circuit breaker."""
+
+    def __init__(self, url: str, reason: str):
+        super().__init__(url, f"host skipped after repeated failures ({reason})")
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, allowing `rate` requests per second on average, in bursts
+    of up to `burst` requests. A rate of None only enforces pauses.
+    """
+
+    def __init__(self, rate: Optional[float], burst: int = 1):
+        """
+        :param rate: Tokens added per second, or None for no limit.
+        :param burst: Maximum number of tokens held.
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """
+        Take a token, or reserve the next one.
+
+        :return: Seconds to wait before the token may be used.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self.rate is None:
+                return wait
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Tokens may go negative: later callers queue up behind earlier reservations
+            self._tokens -= 1
+            if self._tokens < 0:
+                wait = max(wait, -self._tokens / self.rate)
+            return wait
+
+    def acquire(self) -> float:
+        """
+        Wait for a token.
+
+        :return: The number of seconds waited.
+        """
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float):
+        """
+        Hand out no tokens for the next `seconds` seconds.
+
+        :param seconds: The length of the pause.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class _HostState:
+    """
+    Rate limit, concurrency cap and circuit breaker of one host.
+    """
+
+    def __init__(self, max_concurrent: int, rate: Optional[float], burst: int):
+        self.slot = threading.BoundedSemaphore(max_concurrent)
+        self.bucket = TokenBucket(rate, burst)
+        self.failures = 0
+        self.skipped: Optional[str] = None
+
+
+class Fetcher:
+    """
+    Sends GET requests with per-host rate limiting and concurrency caps, retries with
+    exponential backoff, and a circuit breaker.
+
+    Requests answered with a retryable status, or failing with a connection error or
+    timeout, are retried after an exponentially growing, jittered delay, or after the delay
+    the server asks for in Retry-After. A 429 or 503 also halves the request rate of the
+    host, which recovers gradually on successful requests. A host failing
+    `failure_threshold` requests in a row is skipped until `reset` is called.
+    """
+
+    def __init__(
+        self,
+        max_per_host: int = 1,
+        rate: Optional[float] = None,
+        burst: int = 1,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 60,
+        failure_threshold: int = 3,
+        retry_statuses: FrozenSet[int] = RETRY_STATUSES,
+        logger: logging.Logger = logging.getLogger(__name__),
+        metrics: RunMetrics = NULL_METRICS,
+    ):
+        """
+        :param max_per_host: Maximum number of concurrent requests to a host.
+        :param rate: Maximum requests per second to a host. No limit if None.
+        :param burst: Number of requests to a host that may be sent at once before the rate applies.
+        :param retries: Number of retries of a failed request.
+        :param backoff: Delay before the first retry, in seconds. Doubled for every retry.
+        :param max_backoff: Longest delay before a retry. A longer Retry-After fails the request.
+        :param failure_threshold: Number of failed requests in a row before a host is skipped.
+        :param retry_statuses: Response statuses to retry.
+        :param logger: Logger instance.
+        :param metrics: Metrics to record retries, waits and skipped hosts in.
+        """
+        self.max_per_host = max(1, max_per_host)
+        self.rate = rate
+        self.burst = burst
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = max(1, failure_threshold)
+        self.retry_statuses = retry_statuses
+        self.logger = logger
+        self.metrics = metrics
+        self._hosts: Dict[str, _HostState] = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url: str) -> _HostState:
+        host = urlparse(url).netloc
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = _HostState(self.max_per_host, self.rate, self.burst)
+                self._hosts[host] = state
+        return state
+
+    def reset(self):
+        """
+        Give skipped hosts a new chance, e.g. at the start of a run. Rate limits are kept.
+        """
+        with self._lock:
+            for state in self._hosts.values():
+                state.failures = 0
+                state.skipped = None
+
+    def skipped_hosts(self) -> Dict[str, str]:
+        """
+        Get the hosts skipped by the circuit breaker.
+
+        :return: The reason each host was skipped, by host.
+        """
+        with self._lock:
+            return {
+                host: state.skipped
+                for host, state in self._hosts.items()
+                if state.skipped is not None
+            }
+
+    def _retry_after(self, response: requests.Response) -> Optional[float]:
+        """
+        Get the delay asked for by a response's Retry-After header.
+
+        :param response: The response.
+        :return: The delay in seconds, or None if there is no valid header.
+        """
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.max_backoff, self.backoff * 2**attempt)
+        return random.uniform(delay / 2, delay)
+
+    def _slow_down(self, state: _HostState):
+        with self._lock:
+            if state.bucket.rate is not None:
+                state.bucket.rate = max(
+                    self.rate * MIN_RATE_FACTOR, state.bucket.rate / 2
+                )
+
+    def _record_success(self, state: _HostState):
+        with self._lock:
+            state.failures = 0
+            if state.bucket.rate is not None and state.bucket.rate < self.rate:
+                state.bucket.rate = min(self.rate, state.bucket.rate + self.rate / 10)
+
+    def _record_failure(self, state: _HostState, url: str, reason: str):
+        with self._lock:
+            state.failures += 1
+            if state.failures >= self.failure_threshold and state.skipped is None:
+                state.skipped = reason
+                newly_skipped = True
+            else:
+                newly_skipped = False
+        if newly_skipped:
+            host = urlparse(url).netloc
+            self.logger.error(f"Skipping {host} for the rest of the run: {reason}")
+            self.metrics.incr("hosts_skipped")
+
+    def get(self, session: requests.Session, url: str, **kwargs) -> requests.Response:
+        """
+        Send a GET request.
+
+        :param session: The session to send the request with.
+        :param url: The URL to request.
+        :param kwargs: Keyword arguments for session.get.
+        :return: The response. Responses with statuses that are not retried are returned as they are.
+        :raise HostSkipped: If the host is skipped by the circuit breaker.
+        :raise FetchError: If the request failed after all retries.
+        """
+        state = self._host(url)
+        attempt = 0
+        while True:
+            if state.skipped is not None:
+                raise HostSkipped(url, state.skipped)
+
+            with state.slot:
+                waited = state.bucket.acquire()
+                if waited:
+                    self.metrics.observe("rate_limit_wait", waited)
+                try:
+                    response = session.get(url, **kwargs)
+                    error = None
+                except RETRY_ERRORS as e:
+                    response = None
+                    error = e
+                except requests.RequestException as e:
+                    raise FetchError(url, str(e)) from e
+
+            delay = None
+            if response is not None:
+                if response.status_code not in self.retry_statuses:
+                    self._record_success(state)
+                    return response
+                reason = f"HTTP {response.status_code}"
+                delay = self._retry_after(response)
+                if response.status_code in THROTTLE_STATUSES:
+                    self.metrics.incr("http_throttled")
+                    self._slow_down(state)
+                    if delay is not None:
+                        state.bucket.pause(delay)
+                response.close()
+            else:
+                reason = type(error).__name__
+
+            if attempt >= self.retries or (delay is not None and delay > self.max_backoff):
+                self._record_failure(state, url, reason)
+                raise FetchError(url, f"{reason} after {attempt + 1} attempts") from error
+
+            delay = self._backoff(attempt) if delay is None else delay
+            attempt += 1
+            self.logger.warning(
+                f"Request to {url} failed ({reason}), retry {attempt} of {self.retries} in {delay:.1f}s"
+            )
+            self.metrics.incr("http_retries")
+            time.sleep(delay)
@@ -1,5 +1,8 @@
 from pathlib import Path
+import json
+import os
 import os.path
+import tempfile
 
 def create_files(*args):
     for file in args:
@@ -8,6 +11,36 @@ def create_files(*args):
             file_path.parents[0].mkdir(parents=True, exist_ok=True)
             file_path.touch()
 
+def _write_atomic(filename, write):
+    # Write to a temporary file first, so readers never see a half-written file. The
+    # temporary file is unique, as several processes may write the same file.
+    fd, tmp_file = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filename)),
+        prefix=f".{os.path.basename(filename)}.",
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(fd, "w") as fp:
+            write(fp)
+        # mkstemp only gives the owner access, so keep the mode of the replaced file
+        try:
+            os.chmod(tmp_file, os.stat(filename).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_file, 0o644)
+        os.replace(tmp_file, filename)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def write_json_atomic(filename, data):
+    _write_atomic(filename, lambda fp: json.dump(data, fp))
+
+
+def write_text_atomic(filename, text):
+    _write_atomic(filename, lambda fp: fp.write(text))
+
 # TESTING
 if __name__ == '__main__':
     create_files('~/Downloads/arne/går/mot/enfil.txt')
@@ -0,0 +1,236 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from i_o_utilities import create_files, write_json_atomic, write_text_atomic
+
+PROMETHEUS_PREFIX = "scraper"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+    """
+    Timers, counters and gauges for scraper runs, tagged by site and search. Can be
+    exported as a JSON summary and as a Prometheus textfile for node_exporter.
+    """
+
+    enabled = True
+
+    def __init__(
+        self,
+        site: str,
+        json_file: Optional[str] = None,
+        prometheus_file: Optional[str] = None,
+    ):
+        """
+        :param site: The site name to tag all metrics with.
+        :param json_file: Path to write the JSON summary to on export.
+        :param prometheus_file: Path to write the Prometheus textfile to on export.
+        """
+        self.site = site
+        self.json_file = json_file
+        self.prometheus_file = prometheus_file
+        # (name, search) -> [total seconds, count, max seconds]
+        self._timers: Dict[Tuple[str, Optional[str]], list] = {}
+        self._counters: Dict[Tuple[str, Optional[str]], float] = {}
+        self._gauges: Dict[Tuple[str, Optional[str]], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, search: Optional[str] = None):
+        """
+        Record a duration.
+
+        :param name: The timer name.
+        :param seconds: The duration.
+        :param search: The search to tag the duration with, if any.
+        """
+        with self._lock:
+            timer = self._timers.setdefault((name, search), [0.0, 0, 0.0])
+            timer[0] += seconds
+            timer[1] += 1
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str, search: Optional[str] = None):
+        """
+        Time a block of code.
+
+        :param name: The timer name.
+        :param search: The search to tag the duration with, if any.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, search)
+
+    def incr(self, name: str, value: float = 1, search: Optional[str] = None):
+        """
+        Increase a counter.
+
+        :param name: The counter name.
+        :param value: The amount to increase by.
+        :param search: The search to tag the counter with, if any.
+        """
+        with self._lock:
+            key = (name, search)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, search: Optional[str] = None):
+        """
+        Set a gauge.
+
+        :param name: The gauge name.
+        :param value: The value.
+        :param search: The search to tag the gauge with, if any.
+        """
+        with self._lock:
+            self._gauges[(name, search)] = value
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Get all metrics as a JSON serializable dict.
+
+        :return: The summary, with timers, counters and gauges by name and search.
+        """
+        summary = {"site": self.site, "timers": {}, "counters": {}, "gauges": {}}
+        with self._lock:
+            for (name, search), (total, count, longest) in self._timers.items():
+                summary["timers"].setdefault(name, {})[search or ""] = {
+                    "seconds": round(total, 6),
+                    "count": count,
+                    "max_seconds": round(longest, 6),
+                }
+            for kind, values in (("counters", self._counters), ("gauges", self._gauges)):
+                for (name, search), value in values.items():
+                    summary[kind].setdefault(name, {})[search or ""] = value
+        return summary
+
+    @classmethod
+    def from_summary(cls, summary: Dict[str, Any]) -> "RunMetrics":
+        """
+        Rebuild metrics from a summary, e.g. one sent back from another process.
+
+        :param summary: The summary, as returned by `summary`.
+        :return: The metrics.
+        """
+        metrics = cls(summary["site"])
+        for name, by_search in summary["timers"].items():
+            for search, timer in by_search.items():
+                metrics._timers[(name, search or None)] = [
+                    timer["seconds"],
+                    timer["count"],
+                    timer["max_seconds"],
+                ]
+        for kind, values in (
+            ("counters", metrics._counters),
+            ("gauges", metrics._gauges),
+        ):
+            for name, by_search in summary[kind].items():
+                for search, value in by_search.items():
+                    values[(name, search or None)] = value
+        return metrics
+
+    def _prometheus_samples(self) -> Iterator[Tuple[str, str, str]]:
+        def labels(search):
+            label = f'site="{_escape_label(self.site)}"'
+            if search is not None:
+                label += f',search="{_escape_label(search)}"'
+            return "{" + label + "}"
+
+        with self._lock:
+            for (name, search), (total, count, _) in self._timers.items():
+                metric = f"{PROMETHEUS_PREFIX}_{name}_seconds"
+                yield metric, "summary", f"{metric}_sum{labels(search)} {total}"
+                yield metric, "summary", f"{metric}_count{labels(search)} {count}"
+            for kind, values, suffix in (
+                ("counter", self._counters, "_total"),
+                ("gauge", self._gauges, ""),
+            ):
+                for (name, search), value in values.items():
+                    metric = f"{PROMETHEUS_PREFIX}_{name}{suffix}"
+                    yield metric, kind, f"{metric}{labels(search)} {value}"
+
+    def prometheus_text(self) -> str:
+        """
+        Format all metrics in the Prometheus text exposition format.
+
+        :return: The metrics text.
+        """
+        return prometheus_text(self)
+
+    def export(self):
+        """
+        Write the JSON summary and the Prometheus textfile, for those with a file configured.
+        Files are replaced atomically, as required by node_exporter's textfile collector.
+        """
+        if self.json_file:
+            create_files(self.json_file)
+            write_json_atomic(self.json_file, self.summary())
+        if self.prometheus_file:
+            write_prometheus_file(self.prometheus_file, self)
+
+
+class NullMetrics(RunMetrics):
+    """
+    Disabled metrics. All recording methods are no-ops.
+    """
+
+    enabled = False
+    _NULL_TIMER = nullcontext()
+
+    def __init__(self):
+        super().__init__("")
+
+    def observe(self, name, seconds, search=None):
+        pass
+
+    def timer(self, name, search=None):
+        return self._NULL_TIMER
+
+    def incr(self, name, value=1, search=None):
+        pass
+
+    def set(self, name, value, search=None):
+        pass
+
+    def export(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def prometheus_text(*metrics: RunMetrics) -> str:
+    """
+    Format metrics of one or more sites in the Prometheus text exposition format.
+
+    :param metrics: The metrics.
+    :return: The metrics text, with the samples of each metric grouped under one TYPE line.
+    """
+    samples: Dict[str, Tuple[str, List[str]]] = {}
+    for site_metrics in metrics:
+        for metric, kind, sample in site_metrics._prometheus_samples():
+            samples.setdefault(metric, (kind, []))[1].append(sample)
+    lines = []
+    for metric in sorted(samples):
+        kind, metric_samples = samples[metric]
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.extend(metric_samples)
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(filename: str, *metrics: RunMetrics):
+    """
+    Write metrics to a Prometheus textfile, replacing it atomically as required by
+    node_exporter's textfile collector.
+
+    :param filename: Path to the textfile.
+    :param metrics: The metrics.
+    """
+    create_files(filename)
+    write_text_atomic(filename, prometheus_text(*metrics))
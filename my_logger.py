@@ -1,13 +1,40 @@
+import atexit
+import json
 import logging
 from logging import Formatter
+import queue
 import sys
-from copy import copy
-from logging.handlers import TimedRotatingFileHandler
+import threading
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 
 from i_o_utilities import create_files
 
 
-class ColoredFormatter(Formatter):
+class CachedTimeFormatter(Formatter):
+    """
+    A formatter formatting the time of a record only once per second. Only for date formats
+    without sub-second fields.
+    """
+
+    def __init__(self, pattern, date_fmt):
+        """
+        :param pattern: The log message format pattern.
+        :param date_fmt: The date format pattern.
+        """
+        Formatter.__init__(self, pattern, datefmt=date_fmt)
+        # (second, formatted time) of the last formatted record
+        self._last_time = (None, None)
+
+    def formatTime(self, record, datefmt=None):
+        second = int(record.created)
+        last_second, formatted = self._last_time
+        if second != last_second:
+            formatted = Formatter.formatTime(self, record, datefmt)
+            self._last_time = (second, formatted)
+        return formatted
+
+
+class ColoredFormatter(CachedTimeFormatter):
     """
     A custom formatter to add colors to log levels for better readability in the console.
     """
@@ -30,28 +57,138 @@ class ColoredFormatter(Formatter):
         :param pattern: The log message format pattern.
         :param date_fmt: The date format pattern.
         """
-        Formatter.__init__(self, pattern, datefmt=date_fmt)
+        CachedTimeFormatter.__init__(self, pattern, date_fmt)
+        self.colored_levelnames = {
+            levelname: self.color(levelname) for levelname in ColoredFormatter.MAPPING
+        }
+
+    @staticmethod
+    def color(levelname):
+        """
+        Color a level name.
+
+        :param levelname: The level name.
+        :return: The level name wrapped in the ANSI codes of its color.
+        """
+        seq = ColoredFormatter.MAPPING.get(levelname, 37)  # default white
+        return f"{ColoredFormatter.PREFIX}{seq}m{levelname}{ColoredFormatter.SUFFIX}"
 
     def format(self, record):
         """
-        Format the log record with colors based on the log level.
+        Format the log record with colors based on the log level. The record's level name
+        is swapped for the colored one while formatting, instead of copying the record, as
+        handlers of a logger format a record one at a time.
 
         :param record: The log record to format.
         :return: The formatted log record with colors.
         """
-        colored_record = copy(record)
-        levelname = colored_record.levelname
-        seq = ColoredFormatter.MAPPING.get(levelname, 37)  # default white
-        colored_levelname = ("{0}{1}m{2}{3}").format(
-            ColoredFormatter.PREFIX, seq, levelname, ColoredFormatter.SUFFIX
-        )
-        colored_record.levelname = colored_levelname
-        return Formatter.format(self, colored_record)
+        levelname = record.levelname
+        colored_levelname = self.colored_levelnames.get(levelname)
+        record.levelname = colored_levelname or self.color(levelname)
+        try:
+            return Formatter.format(self, record)
+        finally:
+            record.levelname = levelname
+
+
+class JsonFormatter(CachedTimeFormatter):
+    """
+    Formats records as JSON objects, one per line, for log files read by other programs.
+    """
+
+    def format(self, record):
+        """
+        :param record: The log record to format.
+        :return: The record as a JSON object.
+        """
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "file": record.filename,
+            "function": record.funcName,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+OVERFLOW_POLICIES = ("block", "drop_new", "drop_oldest")
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Puts records on a bounded queue, for a QueueListener to handle in another thread. When
+    the queue is full, the caller waits ("block"), the new record is dropped ("drop_new"),
+    or the oldest queued record is dropped to make room ("drop_oldest").
+    """
+
+    def __init__(self, record_queue, overflow="block"):
+        """
+        :param record_queue: The bounded queue.
+        :param overflow: The overflow policy, one of OVERFLOW_POLICIES.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Overflow policy must be one of {OVERFLOW_POLICIES}")
+        QueueHandler.__init__(self, record_queue)
+        self.overflow = overflow
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def _drop(self):
+        with self._dropped_lock:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # The queue handler is the only handler of the logger in async mode, so the record
+        # is not copied. Only the message is merged, while the arguments still hold the
+        # values of the call. Formatting is left to the listener thread.
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                if self.overflow == "drop_new":
+                    self._drop()
+                    return
+            try:
+                self.queue.get_nowait()
+                self._drop()
+            except queue.Empty:
+                pass
+
+
+class _Listener(QueueListener):
+    """
+    A QueueListener that waits for room for its stop sentinel in a full queue.
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
 
 
 class MyLogger:
     """
     A custom logger class to handle logging with colored output and file rotation.
+
+    In async mode, the logger only puts records on a bounded queue, and a listener thread
+    owning all handlers formats and writes them. Logging calls then cost the scraping
+    threads no formatting or disk writes. Queued records are written when `stop` is
+    called, or at interpreter exit.
     """
 
     FORMAT = (
@@ -59,18 +196,41 @@ class MyLogger:
     )
     DATE_FMT = "%Y-%m-%d %H:%M:%S"
     FORMATTER = ColoredFormatter(FORMAT, DATE_FMT)
+    # File handlers get no color codes
+    FILE_FORMATTERS = {
+        "plain": CachedTimeFormatter(FORMAT, DATE_FMT),
+        "json": JsonFormatter(FORMAT, DATE_FMT),
+        "colored": FORMATTER,
+    }
 
-    def __init__(self, logger_base_level="DEBUG", logger_name=__name__):
+    def __init__(
+        self,
+        logger_base_level="DEBUG",
+        logger_name=__name__,
+        async_mode=False,
+        queue_size=10000,
+        overflow="block",
+    ):
         """
         Initialize the MyLogger instance.
 
         :param logger_base_level: Handlers only receive logs from this level upwards.
         :param logger_name: Name used for storing logger in internal logger hierarchy. Should be exclusive.
+        :param async_mode: Write records from a listener thread, through a bounded queue.
+        :param queue_size: Maximum number of queued records in async mode.
+        :param overflow: What to do when the queue is full: "block", "drop_new" or "drop_oldest".
         """
         self.logger_level = getattr(logging, logger_base_level)
         self.logger = logging.getLogger(logger_name)
         self.logger.setLevel(self.logger_level)
         self.logger.propagate = False
+        self.async_mode = async_mode
+        # Handlers owned by the listener thread in async mode
+        self._handlers = []
+        self._queue_handler = None
+        self._listener = None
+        if async_mode:
+            self._queue_handler = BoundedQueueHandler(queue.Queue(queue_size), overflow)
 
     def add_handler(
         self,
@@ -81,7 +241,8 @@ class MyLogger:
         rollover_interval=7,
         rollover_type="D",
         max_log_files=7,
-        log_dir=None
+        log_dir=None,
+        file_format="plain",
     ):
         """
         Add a handler for logging to std.out or file. If file handler, batch store log files by week.
@@ -92,10 +253,15 @@ class MyLogger:
         :param rollover_interval: Number of days between log rotations.
         :param rollover_type: Type of rollover interval (e.g., 'D' for days, 'S' for seconds). Defaults to days.
         :param max_log_files: Maximum number of log files to keep.
+        :param file_format: Format of file handlers: "plain", "json" (one object per line) or "colored".
         :return: MyLogger object.
         """
         level = level if level else self.logger_level
+        formatter = MyLogger.FORMATTER
         if write_to_file or filename or log_dir:
+            if file_format not in MyLogger.FILE_FORMATTERS:
+                raise ValueError(f"File format must be one of {tuple(MyLogger.FILE_FORMATTERS)}")
+            formatter = MyLogger.FILE_FORMATTERS[file_format]
             if log_dir: # Remove trailing slash
                 log_dir = log_dir[:-1] if log_dir[-1] == "/" else log_dir
             filename = filename if filename else f"{log_dir}/{level}.log"
@@ -114,16 +280,64 @@ class MyLogger:
         else:
             handler = logging.StreamHandler(sys.stdout)
 
-        handler.setFormatter(MyLogger.FORMATTER)
+        handler.setFormatter(formatter)
         handler.setLevel(level)
 
         # Only add handler if it is not already added
-        if not any(h.baseFilename == handler.baseFilename for h in self.logger.handlers if hasattr(h, 'baseFilename')):
-            self.logger.addHandler(handler)
+        handlers = self._handlers if self.async_mode else self.logger.handlers
+        if not any(h.baseFilename == handler.baseFilename for h in handlers if hasattr(h, 'baseFilename')):
+            if self.async_mode:
+                self._add_async_handler(handler)
+            else:
+                self.logger.addHandler(handler)
         else:
             print(f"Handler with filename {handler.baseFilename} already added.")
         return self
 
+    def _add_async_handler(self, handler):
+        """
+        Hand a handler to the listener thread, starting it with the first handler.
+        """
+        self._handlers.append(handler)
+        # Records no handler wants are not queued at all
+        self._queue_handler.setLevel(min(h.level for h in self._handlers))
+        if self._listener is None:
+            self._listener = _Listener(
+                self._queue_handler.queue, *self._handlers, respect_handler_level=True
+            )
+            self._listener.start()
+            self.logger.addHandler(self._queue_handler)
+            atexit.register(self.stop)
+        else:
+            self._listener.handlers = tuple(self._handlers)
+
+    @property
+    def dropped(self):
+        """
+        The number of records dropped because the queue was full, in async mode.
+        """
+        return self._queue_handler.dropped if self._queue_handler else 0
+
+    def stop(self):
+        """
+        Write all queued records and stop the listener thread, in async mode. Later
+        records are written directly by the handlers.
+        """
+        if self._listener is None:
+            return
+        atexit.unregister(self.stop)
+        listener, self._listener = self._listener, None
+        for handler in self._handlers:
+            self.logger.addHandler(handler)
+        self.logger.removeHandler(self._queue_handler)
+        # Waits for the queued records to be written
+        listener.stop()
+        self.async_mode = False
+        if self.dropped:
+            self.logger.warning(
+                f"Dropped {self.dropped} log records because the log queue was full"
+            )
+
     def set_logger_level(self, new_level):
         """
         Set the logging level on the logger.
@@ -147,16 +361,16 @@ class MyLogger:
         return self.logger
 
 
-def default_logger(log_dir="."):
+def default_logger(log_dir=".", async_mode=False):
     """
     Configure logging for the application.
 
-    :param log_file: Path to the log file.
-    :param logger_base_level: Base logging level.
+    :param log_dir: Directory of the log files.
+    :param async_mode: Write records from a listener thread. See MyLogger.
     :return: Configured logger instance.
     """
     logger = (
-        MyLogger()
+        MyLogger(async_mode=async_mode)
         .add_handler(level="INFO")
         .add_handler(level="DEBUG", write_to_file=True, log_dir=log_dir)
         .add_handler(level="INFO", write_to_file=True, log_dir=log_dir)
@@ -1,15 +1,12 @@
 import os
-import http.client
-import urllib
-import send_email
-from my_logger import default_logger
-import yaml
-import platform
 import logging
+import threading
+import time
 
-os_syst = platform.system()
-if os_syst == "Darwin":
-    import keyring
+import credentials
+
+# The HTTP and SMTP modules are imported by the functions using them, and yaml and keyring
+# by the credential backends, so importing this module is cheap for runs that send nothing.
 
 logger = logging.getLogger(__name__)
 
@@ -22,48 +19,304 @@ class PushoverNotificationFailed(Exception):
     pass
 
 
+PUSHOVER_ENDPOINT = "https://api.pushover.net/1/messages.json"
+# Longest message Pushover accepts, in characters
+PUSHOVER_MAX_MESSAGE = 1024
+# Room kept in each part of a split message for its "(i/n) " part number
+PART_NUMBER_ROOM = 10
+# Share of the monthly message limit left when warnings start
+LOW_LIMIT_SHARE = 0.1
+# Seconds to hold messages back after a 429 without a reset time or Retry-After header
+LIMIT_RETRY_DELAY = 60 * 60
+
+
+def split_message(text, limit=PUSHOVER_MAX_MESSAGE):
+    """
+    Split a message into parts Pushover accepts. Parts are split at line breaks where
+    possible, and never inside an html tag or link. Parts of split messages are numbered.
+
+    :param text: The message.
+    :param limit: The longest part, in characters.
+    :return: The parts, in order.
+    """
+    if len(text) <= limit:
+        return [text]
+    size = limit - PART_NUMBER_ROOM
+    parts = []
+    rest = text
+    while len(rest) > size:
+        cut = rest.rfind("\n", 0, size + 1)
+        if cut > 0:
+            parts.append(rest[:cut])
+            rest = rest[cut + 1 :]
+            continue
+        cut = size
+        # Do not cut inside a tag, or between the tags of a link
+        tag = rest.rfind("<", 0, cut)
+        if tag > rest.rfind(">", 0, cut):
+            cut = tag if tag > 0 else cut
+        link = rest.rfind("<a ", 0, cut)
+        if link > rest.rfind("</a>", 0, cut):
+            cut = link if link > 0 else cut
+        parts.append(rest[:cut])
+        rest = rest[cut:]
+    parts.append(rest)
+    return [f"({i}/{len(parts)}) {part}" for i, part in enumerate(parts, 1)]
+
+
+class PushoverLimitReached(PushoverNotificationFailed):
+    """Raised when the app has no messages left until its monthly limit resets."""
+
+    def __init__(self, reset):
+        resets = time.ctime(reset) if reset else "unknown"
+        super().__init__(f"Pushover message limit reached, resets at {resets}")
+        self.reset = reset
+
+
+class PushoverClient:
+    """
+    Sends Pushover notifications over one keep-alive connection. Credentials are resolved
+    through the shared credential provider of the secrets file. Messages longer
+    than Pushover's limit are sent in several parts. The app's message limit is tracked
+    through the X-Limit-App-* response headers, and nothing is sent while it is used up.
+    """
+
+    def __init__(
+        self,
+        token=None,
+        user_key=None,
+        secrets_file=None,
+        endpoint=PUSHOVER_ENDPOINT,
+        timeout=30,
+    ):
+        """
+        :param token: The app token. Overridden by pushover_token in the secrets file, or
+            the PUSHOVER_TOKEN environment variable.
+        :param user_key: The user key. Overridden by pushover_user_key in the secrets file,
+            or the PUSHOVER_USER_KEY environment variable.
+        :param secrets_file: YAML file with the credentials, if any.
+        :param endpoint: URL of the messages API.
+        :param timeout: Seconds to wait for the API.
+        """
+        from urllib.parse import urlsplit
+
+        self.token = token
+        self.user_key = user_key
+        self.secrets_file = os.path.abspath(secrets_file) if secrets_file else None
+        self.endpoint = endpoint
+        self.timeout = timeout
+        url = urlsplit(endpoint)
+        self._https = url.scheme == "https"
+        self._host = url.hostname
+        self._port = url.port
+        self._path = url.path + (f"?{url.query}" if url.query else "")
+        self._conn = None
+        # Requests sent over the current connection
+        self._conn_requests = 0
+        # Message limit of the app, from the last response
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self._lock = threading.Lock()
+
+    def _credentials(self):
+        try:
+            return credentials.pushover_credentials(
+                self.token, self.user_key, self.secrets_file
+            )
+        except credentials.CredentialNotFound as e:
+            logger.error(
+                "The secrets.yaml file does not exist and/or pushover_key is not provided."
+            )
+            raise PushoverKeysNotFound(str(e)) from e
+
+    def _connection(self):
+        if self._conn is None:
+            import http.client
+
+            connection_class = (
+                http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            )
+            self._conn = connection_class(self._host, self._port, timeout=self.timeout)
+            self._conn_requests = 0
+        return self._conn
+
+    def _post(self, fields):
+        """
+        Post a form to the API, reconnecting once if the server closed the kept-alive
+        connection.
+
+        :return: The response, and its body.
+        """
+        import http.client
+        from urllib.parse import urlencode
+
+        while True:
+            conn = self._connection()
+            reused = self._conn_requests > 0
+            try:
+                conn.request(
+                    "POST",
+                    self._path,
+                    urlencode(fields),
+                    {"Content-type": "application/x-www-form-urlencoded"},
+                )
+                response = conn.getresponse()
+                # Read the whole response, so the connection can be reused
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if reused:
+                    continue
+                raise
+            self._conn_requests += 1
+            if response.will_close:
+                self.close()
+            return response, body
+
+    def _update_limit(self, response):
+        try:
+            self.limit = int(response.getheader("X-Limit-App-Limit"))
+            self.remaining = int(response.getheader("X-Limit-App-Remaining"))
+            self.reset = int(response.getheader("X-Limit-App-Reset"))
+        except (TypeError, ValueError):
+            return
+        if self.remaining < self.limit * LOW_LIMIT_SHARE:
+            logger.warning(
+                f"{self.remaining} of {self.limit} Pushover messages left until "
+                f"{time.ctime(self.reset)}"
+            )
+
+    def _limit_reached(self, response):
+        """
+        Hold messages back until the limit resets. Without a known reset time, until the
+        server's Retry-After, or LIMIT_RETRY_DELAY, has passed.
+        """
+        self.remaining = 0
+        if self.reset is None or self.reset <= time.time():
+            try:
+                delay = int(response.getheader("Retry-After"))
+            except (TypeError, ValueError):
+                delay = LIMIT_RETRY_DELAY
+            self.reset = int(time.time()) + max(0, min(delay, LIMIT_RETRY_DELAY))
+        logger.error("Pushover message limit reached")
+        raise PushoverLimitReached(self.reset)
+
+    def _check_limit(self, messages):
+        if self.remaining is None or self.remaining >= messages:
+            return
+        if self.reset is not None and time.time() >= self.reset:
+            # A new month, the limit is known again after the next response
+            self.remaining = None
+            return
+        logger.error("Pushover message limit reached")
+        raise PushoverLimitReached(self.reset)
+
+    def send(self, text, html=True):
+        """
+        Send a notification, split into several messages if it is too long.
+
+        :param text: The message.
+        :param html: Whether the message is html.
+        :raise PushoverKeysNotFound: If there are no credentials.
+        :raise PushoverLimitReached: If the app's message limit is used up.
+        :raise PushoverNotificationFailed: If Pushover refuses a message.
+        """
+        token, user_key = self._credentials()
+        parts = split_message(text)
+        with self._lock:
+            # Send all parts or none, as far as the known limit goes
+            self._check_limit(len(parts))
+            for part in parts:
+                fields = {"token": token, "user": user_key, "message": part}
+                if html:
+                    fields["html"] = 1  # Enable html formatting
+                response, body = self._post(fields)
+                self._update_limit(response)
+                logger.info(f"Pushover response status: {response.status}")
+                if response.status == 429:
+                    self._limit_reached(response)
+                if response.status != 200:
+                    error_message = (
+                        f"Pushover notification failed: {response.reason} {body[:200]!r}"
+                    )
+                    logger.error(error_message)
+                    raise PushoverNotificationFailed(error_message)
+        logger.info(f"Pushover notification sent successfully, in {len(parts)} message(s)")
+
+    def close(self):
+        """
+        Close the connection.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_pushover_clients = {}
+_pushover_clients_lock = threading.Lock()
+
+
+def pushover_client(
+    pushover_token=None, pushover_key=None, secrets_file=None, endpoint=PUSHOVER_ENDPOINT
+):
+    """
+    Get the shared Pushover client of a set of credentials, creating it on first use.
+    """
+    key = (
+        pushover_token,
+        pushover_key,
+        os.path.abspath(secrets_file) if secrets_file else None,
+        endpoint,
+    )
+    with _pushover_clients_lock:
+        client = _pushover_clients.get(key)
+        if client is None:
+            client = PushoverClient(pushover_token, pushover_key, secrets_file, endpoint)
+            _pushover_clients[key] = client
+    return client
+
+
 def push_notification(
-    text, pushover_token=None, pushover_key=None, secrets_file="./input/secrets.yaml"
+    text,
+    pushover_token=None,
+    pushover_key=None,
+    secrets_file="./input/secrets.yaml",
+    endpoint=PUSHOVER_ENDPOINT,
 ):
+    """
+    Send a Pushover notification, through the shared client of the credentials.
+    """
     logger.info("Starting push_notification function")
-    secrets_file = os.path.abspath(secrets_file)  # Resolve the absolute path
-    logger.debug(f"Resolved secrets file path: {secrets_file}")
-
-    if os.path.exists(secrets_file):
-        with open(secrets_file, "r") as f:
-            secrets = yaml.safe_load(f)
-            pushover_key = secrets.get("pushover_user_key", pushover_key)
-            pushover_token = secrets.get("pushover_token", pushover_token)
-    if not pushover_key or not pushover_token:
-        logger.error(
-            "The secrets.yaml file does not exist and/or pushover_key is not provided."
-        )
-        raise PushoverKeysNotFound(
-            "The secrets.yaml file does not exist and/or pushover credentials are not provided."
-        )
+    pushover_client(pushover_token, pushover_key, secrets_file, endpoint).send(text)
+
 
-    conn = http.client.HTTPSConnection("api.pushover.net:443")
-    conn.request(
-        "POST",
-        "/1/messages.json",
-        urllib.parse.urlencode(
-            {
-                "token": pushover_token,
-                "user": pushover_key,
-                "message": text,
-                "html": 1,  # Enable html formatting
-            }
-        ),
-        {"Content-type": "application/x-www-form-urlencoded"},
+def email_password(sender_email, pwd_file=None, keychain_name=None):
+    """
+    Get the password of an email account, from a file, the EMAIL_PASSWORD environment
+    variable or the macOS keychain. Looked up once per process, and again when the file
+    changes.
+    """
+    return credentials.email_provider(sender_email, pwd_file, keychain_name).require(
+        credentials.EMAIL_PASSWORD
     )
-    response = conn.getresponse()
-    logger.info(f"Pushover response status: {response.status}")
-    if response.status != 200:
-        error_message = f"Pushover notification failed: {response.reason}"
-        logger.error(error_message)
-        raise PushoverNotificationFailed(error_message)
-    else:
-        logger.info("Pushover notification sent successfully")
+
+
+def forget_email_password(sender_email, pwd_file=None, keychain_name=None):
+    """
+    Make the next email_password call look the password up again, e.g. after it was
+    rejected.
+    """
+    credentials.email_provider(sender_email, pwd_file, keychain_name).invalidate()
+
+
+def is_auth_error(error):
+    """
+    Check if an error is an SMTP server rejecting a login.
+    """
+    import smtplib
+
+    return isinstance(error, smtplib.SMTPAuthenticationError)
 
 
 def mail(
@@ -80,17 +333,9 @@ def mail(
     if files is None:
         files = []
 
-    if pwd_file:
-        pwd_file = os.path.expanduser(pwd_file)
-        with open(pwd_file, "r") as file:
-            password = file.read()
-    elif os_syst == "Darwin":  # Macos
-        try:
-            password = keyring.get_password(keychain_name, sender_email)
-        except Exception as e:
-                logger.error(f"Failed to retrieve password from keyring: {e}")
-    else:
-        raise Exception("PasswordNotExists")
+    password = email_password(sender_email, pwd_file, keychain_name)
+
+    import send_email
 
     try:
         send_email.send_email(
@@ -104,6 +349,43 @@ def mail(
         )
     except Exception as e:
         logger.error(f"Failed to send email: {e}")
+        if is_auth_error(e):
+            forget_email_password(sender_email, pwd_file, keychain_name)
+        raise e
+
+
+def mail_many(messages, sender_email, pwd_file=None, keychain_name=None):
+    """
+    Send several emails over one SMTP connection.
+
+    :param messages: (recipient, subject, text, html) tuples.
+    :param sender_email: The account to send from.
+    :param pwd_file: File holding the password of the account.
+    :param keychain_name: Keychain service holding the password, if there is no pwd_file.
+    """
+    logger.info(f"Sending {len(messages)} emails")
+    password = email_password(sender_email, pwd_file, keychain_name)
+
+    import send_email
+
+    try:
+        send_email.send_emails(
+            [
+                (
+                    recipient,
+                    send_email.build_message(
+                        recipient, subj, text, sender_email=sender_email, html=html
+                    ),
+                )
+                for recipient, subj, text, html in messages
+            ],
+            sender_email=sender_email,
+            password=password,
+        )
+    except Exception as e:
+        logger.error(f"Failed to send emails: {e}")
+        if is_auth_error(e):
+            forget_email_password(sender_email, pwd_file, keychain_name)
         raise e
 
 
@@ -0,0 +1,676 @@
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Tuple
+
+import notify
+from i_o_utilities import create_files
+
+# Only needed once the outbox is used, so imported where it is used
+if TYPE_CHECKING:
+    import sqlite3
+
+    from send_email import Mailer
+
+DEFAULT_OUTBOX_FILE = "./data/outbox.db"
+DEFAULT_WINDOW = 5 * 60
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_KEEP_DAYS = 7
+# Delay before retrying a failed notification, doubled for every failed attempt
+DEFAULT_RETRY_BACKOFF = 30
+DEFAULT_MAX_BACKOFF = 30 * 60
+DEFAULT_INTERVAL = 30
+DEFAULT_STOP_TIMEOUT = 60
+
+EMAIL = "email"
+PUSHOVER = "pushover"
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class OutboxItem(NamedTuple):
+    id: int
+    channel: str
+    recipient: str
+    subject: str
+    body: str
+    html: bool
+    site: Optional[str]
+    # Channel specific send options, like the password file of an email account
+    options: Dict[str, Any]
+    created: float
+    attempts: int
+
+
+class DeliveryStatus(NamedTuple):
+    id: int
+    channel: str
+    recipient: str
+    status: str
+    attempts: int
+    last_error: Optional[str]
+    # Earliest time of the next attempt, if the item is pending
+    next_attempt: float
+
+
+class NotificationOutbox:
+    """
+    Durable queue of notifications, in an SQLite database that several processes can share.
+    Scrapers enqueue their notifications, and a Dispatcher sends them. An item stays
+    pending until it is sent, so notifications survive crashes and failed sends. Items are
+    sent at least once: a crash right after sending may send an item again.
+    """
+
+    def __init__(self, filename: str = DEFAULT_OUTBOX_FILE):
+        """
+        :param filename: Path to the database file.
+        """
+        self.filename = filename
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Lets the outbox be passed to worker processes, which open their own connection
+        return {"filename": self.filename}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__init__(state["filename"])
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            import sqlite3
+
+            create_files(self.filename)
+            conn = sqlite3.connect(self.filename, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS outbox ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "channel TEXT NOT NULL, "
+                    "recipient TEXT NOT NULL, "
+                    "subject TEXT NOT NULL, "
+                    "body TEXT NOT NULL, "
+                    "html INTEGER NOT NULL, "
+                    "site TEXT, "
+                    "options TEXT NOT NULL, "
+                    "created REAL NOT NULL, "
+                    "status TEXT NOT NULL, "
+                    "attempts INTEGER NOT NULL DEFAULT 0, "
+                    "last_error TEXT, "
+                    "updated REAL NOT NULL, "
+                    "next_attempt REAL NOT NULL DEFAULT 0)"
+                )
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(outbox)")]
+                if "next_attempt" not in columns:
+                    # Outboxes created before failed sends were retried with a delay
+                    conn.execute(
+                        "ALTER TABLE outbox ADD COLUMN next_attempt REAL NOT NULL DEFAULT 0"
+                    )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, created)"
+                )
+            self._conn = conn
+        return self._conn
+
+    def enqueue(
+        self,
+        channel: str,
+        recipient: str,
+        subject: str,
+        body: str,
+        html: bool = False,
+        site: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> int:
+        """
+        Add a notification to the outbox.
+
+        :param channel: The channel to send through, EMAIL or PUSHOVER.
+        :param recipient: The email address, or Pushover user key, to send to.
+        :param subject: The subject.
+        :param body: The text.
+        :param html: Whether the text is html.
+        :param site: The site the notification is from.
+        :param options: Channel specific send options. Only items with the same options are
+            sent together.
+        :return: The id of the item.
+        """
+        return self.enqueue_many(
+            [
+                {
+                    "channel": channel,
+                    "recipient": recipient,
+                    "subject": subject,
+                    "body": body,
+                    "html": html,
+                    "site": site,
+                    "options": options,
+                }
+            ]
+        )[0]
+
+    def enqueue_many(self, notifications: List[Dict[str, Any]]) -> List[int]:
+        """
+        Add notifications to the outbox in one transaction, so either all or none of them
+        are added. Used to queue a notification on several channels at once.
+
+        :param notifications: The notifications, as keyword arguments for `enqueue`.
+        :return: The ids of the items, in the order of the notifications.
+        """
+        now = time.time()
+        ids = []
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for notification in notifications:
+                    cursor = conn.execute(
+                        "INSERT INTO outbox (channel, recipient, subject, body, html, site, "
+                        "options, created, status, updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            notification["channel"],
+                            notification["recipient"],
+                            notification["subject"],
+                            notification["body"],
+                            int(notification.get("html", False)),
+                            notification.get("site"),
+                            json.dumps(notification.get("options") or {}, sort_keys=True),
+                            now,
+                            PENDING,
+                            now,
+                        ),
+                    )
+                    ids.append(cursor.lastrowid)
+        return ids
+
+    def pending(
+        self,
+        channel: Optional[str] = None,
+        due: Optional[float] = None,
+        site: Optional[str] = None,
+    ) -> List[OutboxItem]:
+        """
+        Get the pending items, oldest first.
+
+        :param channel: Only get items of this channel. All channels if None.
+        :param due: Only get items whose next attempt is due at this time. Items waiting to
+            be retried are included if None.
+        :param site: Only get items of this site. All sites if None.
+        :return: The items.
+        """
+        query = (
+            "SELECT id, channel, recipient, subject, body, html, site, options, created, "
+            "attempts FROM outbox WHERE status = ?"
+        )
+        params: Tuple = (PENDING,)
+        if channel is not None:
+            query += " AND channel = ?"
+            params += (channel,)
+        if due is not None:
+            query += " AND next_attempt <= ?"
+            params += (due,)
+        if site is not None:
+            query += " AND site = ?"
+            params += (site,)
+        with self._lock:
+            rows = self._connect().execute(query + " ORDER BY created, id", params).fetchall()
+        return [
+            OutboxItem(*row[:5], bool(row[5]), row[6], json.loads(row[7]), *row[8:])
+            for row in rows
+        ]
+
+    def mark_sent(self, ids: List[int]):
+        """
+        Mark items as sent.
+
+        :param ids: The ids of the items.
+        """
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "UPDATE outbox SET status = ?, updated = ? WHERE id = ?",
+                    ((SENT, time.time(), id) for id in ids),
+                )
+
+    def mark_failed(
+        self,
+        ids: List[int],
+        error: str,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff: float = 0,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+    ):
+        """
+        Record a failed attempt to send items. Items are given up on after `max_attempts`
+        attempts.
+
+        :param ids: The ids of the items.
+        :param error: The error the send failed with.
+        :param max_attempts: The number of attempts before an item is marked as failed.
+        :param backoff: Seconds to wait before the next attempt of an item failing for the
+            first time. Doubled for every earlier failed attempt of the item.
+        :param max_backoff: Longest wait before the next attempt.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "UPDATE outbox SET attempts = attempts + 1, last_error = ?, updated = ?, "
+                    "status = CASE WHEN attempts + 1 >= ? THEN ? ELSE status END, "
+                    "next_attempt = ? + MIN(?, ? * (1 << MIN(attempts, 30))) "
+                    "WHERE id = ?",
+                    (
+                        (error, now, max_attempts, FAILED, now, max_backoff, backoff, id)
+                        for id in ids
+                    ),
+                )
+
+    def statuses(self, ids: List[int]) -> Dict[int, DeliveryStatus]:
+        """
+        Get the delivery status of items.
+
+        :param ids: The ids of the items.
+        :return: The status of each item still in the outbox, by id.
+        """
+        if not ids:
+            return {}
+        with self._lock:
+            rows = (
+                self._connect()
+                .execute(
+                    "SELECT id, channel, recipient, status, attempts, last_error, next_attempt "
+                    f"FROM outbox WHERE id IN ({', '.join('?' * len(ids))})",
+                    tuple(ids),
+                )
+                .fetchall()
+            )
+        return {row[0]: DeliveryStatus(*row) for row in rows}
+
+    def purge(self, keep_days: float = DEFAULT_KEEP_DAYS) -> int:
+        """
+        Delete sent and failed items older than `keep_days` days.
+
+        :param keep_days: Days to keep finished items for.
+        :return: The number of deleted items.
+        """
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute(
+                    "DELETE FROM outbox WHERE status != ? AND updated < ?",
+                    (PENDING, time.time() - keep_days * 24 * 3600),
+                )
+            return cursor.rowcount
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class Dispatcher:
+    """
+    Sends the pending notifications of an outbox. Notifications to the same recipient,
+    through the same channel and with the same send options, are coalesced into one
+    digest. A digest is held back until its oldest notification has waited `window`
+    seconds, so bursts of notifications become one message. All emails of a dispatch are
+    sent over one SMTP connection, and Pushover messages over a kept-alive HTTPS
+    connection.
+    The channels are sent in parallel, so a slow SMTP server does not hold back Pushover
+    messages. Failed notifications are retried after an exponentially growing delay.
+    """
+
+    def __init__(
+        self,
+        outbox: NotificationOutbox,
+        window: float = DEFAULT_WINDOW,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        keep_days: float = DEFAULT_KEEP_DAYS,
+        smtp: Optional[Dict[str, Any]] = None,
+        retry_backoff: float = DEFAULT_RETRY_BACKOFF,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+        pushover_endpoint: str = notify.PUSHOVER_ENDPOINT,
+        site: Optional[str] = None,
+        logger: logging.Logger = logging.getLogger(__name__),
+    ):
+        """
+        :param outbox: The outbox to send from.
+        :param window: Seconds to collect notifications for before sending a digest.
+        :param max_attempts: The number of attempts to send a notification before giving up.
+        :param keep_days: Days to keep sent and failed notifications in the outbox for.
+        :param smtp: Mailer arguments for the SMTP server, like host, port and tls.
+            Gmail if None.
+        :param retry_backoff: Seconds to wait before retrying a failed notification. Doubled
+            for every failed attempt.
+        :param max_backoff: Longest wait before retrying a failed notification.
+        :param pushover_endpoint: URL of the Pushover messages API.
+        :param site: Only send notifications of this site, leaving the others to their own
+            dispatchers. All sites if None.
+        :param logger: Logger instance.
+        """
+        self.outbox = outbox
+        self.window = window
+        self.max_attempts = max_attempts
+        self.keep_days = keep_days
+        self.smtp = smtp or {}
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.pushover_endpoint = pushover_endpoint
+        self.site = site
+        self.logger = logger
+        # Connected mailers by sending account, kept open between dispatches
+        self._mailers: Dict[str, Mailer] = {}
+
+    def _due_groups(
+        self, now: float, force: bool
+    ) -> Dict[Tuple[str, str, str], List[OutboxItem]]:
+        groups: Dict[Tuple[str, str, str], List[OutboxItem]] = {}
+        for item in self.outbox.pending(due=now, site=self.site):
+            key = (item.channel, item.recipient, json.dumps(item.options, sort_keys=True))
+            groups.setdefault(key, []).append(item)
+        # Items are sorted by age, so the first item of a group is the oldest
+        return {
+            key: items
+            for key, items in groups.items()
+            if force or now - items[0].created >= self.window
+        }
+
+    def _mark_failed(self, ids: List[int], error: str):
+        self.outbox.mark_failed(
+            ids, error, self.max_attempts, self.retry_backoff, self.max_backoff
+        )
+
+    @staticmethod
+    def digest(items: List[OutboxItem]) -> Tuple[str, str, bool]:
+        """
+        Combine notifications into one message.
+
+        :param items: The notifications, oldest first.
+        :return: The subject, text and whether the text is html.
+        """
+        if len(items) == 1:
+            return items[0].subject, items[0].body, items[0].html
+        html = any(item.html for item in items)
+        sites = list(dict.fromkeys(item.site for item in items if item.site))
+        subject = f"{len(items)} varsler"
+        if sites:
+            subject += f" fra {', '.join(sites)}"
+        separator = "\n\n<hr>\n\n" if html else "\n\n----------\n\n"
+        body = separator.join(f"{item.subject}\n\n{item.body}" for item in items)
+        return subject, body, html
+
+    def _send_emails(self, groups: List[Tuple[Dict[str, Any], List[OutboxItem]]]):
+        # One connection per sending account, reused across dispatches
+        by_account: Dict[str, List[List[OutboxItem]]] = {}
+        for options, items in groups:
+            by_account.setdefault(json.dumps(options, sort_keys=True), []).append(items)
+        from send_email import build_message
+
+        for account, digests in by_account.items():
+            options = json.loads(account)
+            sender_email = options.get("sender_email") or digests[0][0].recipient
+            messages = []
+            for items in digests:
+                subject, body, html = self.digest(items)
+                message = build_message(
+                    items[0].recipient, subject, body, sender_email=sender_email, html=html
+                )
+                messages.append((items[0].recipient, message))
+            try:
+                mailer = self._mailer(account, options, digests[0][0].recipient)
+                errors = mailer.send_many(messages)
+            except Exception as e:
+                self.logger.error(f"Could not send {len(messages)} email digests: {e}")
+                if notify.is_auth_error(e):
+                    # Look the password up again on the next attempt
+                    self._forget_mailer(account, options, digests[0][0].recipient)
+                ids = [item.id for items in digests for item in items]
+                self._mark_failed(ids, str(e))
+                continue
+            for index, items in enumerate(digests):
+                ids = [item.id for item in items]
+                if index in errors:
+                    self._mark_failed(ids, str(errors[index]))
+                else:
+                    self.outbox.mark_sent(ids)
+            self.logger.info(
+                f"Sent {len(messages) - len(errors)} of {len(messages)} email digests"
+            )
+
+    def _mailer(self, account: str, options: Dict[str, Any], recipient: str) -> Mailer:
+        """
+        Get the connected mailer of a sending account, creating it on first use.
+
+        :param account: The account key.
+        :param options: The send options of the account.
+        :param recipient: A recipient, used as the sender if the options have none.
+        :return: The mailer.
+        """
+        mailer = self._mailers.get(account)
+        if mailer is None:
+            from send_email import Mailer
+
+            sender_email = options.get("sender_email") or recipient
+            password = notify.email_password(
+                sender_email, options.get("pwd_file"), options.get("keychain_name")
+            )
+            mailer = Mailer(sender_email, password, logger=self.logger, **self.smtp)
+            self._mailers[account] = mailer
+        return mailer
+
+    def _forget_mailer(self, account: str, options: Dict[str, Any], recipient: str):
+        mailer = self._mailers.pop(account, None)
+        if mailer is not None:
+            mailer.close()
+        notify.forget_email_password(
+            options.get("sender_email") or recipient,
+            options.get("pwd_file"),
+            options.get("keychain_name"),
+        )
+
+    def close(self):
+        """
+        Close the connections kept open between dispatches.
+        """
+        for mailer in self._mailers.values():
+            mailer.close()
+        self._mailers = {}
+
+    def _send_pushover(self, groups: List[Tuple[Dict[str, Any], List[OutboxItem]]]):
+        for options, items in groups:
+            subject, body, _ = self.digest(items)
+            ids = [item.id for item in items]
+            # Clients keep their connection open between dispatches
+            client = notify.pushover_client(
+                options.get("token"),
+                items[0].recipient or None,
+                options.get("secrets_file"),
+                self.pushover_endpoint,
+            )
+            try:
+                client.send(body)
+            except Exception as e:
+                self.logger.error(f"Could not send Pushover digest: {e}")
+                self._mark_failed(ids, str(e))
+                continue
+            self.outbox.mark_sent(ids)
+
+    def _send_channel(
+        self, channel: str, groups: List[Tuple[Dict[str, Any], List[OutboxItem]]]
+    ):
+        if channel == EMAIL:
+            self._send_emails(groups)
+        elif channel == PUSHOVER:
+            self._send_pushover(groups)
+        else:
+            ids = [item.id for _, items in groups for item in items]
+            self.logger.error(f"Unknown notification channel '{channel}'")
+            self.outbox.mark_failed(ids, f"Unknown channel '{channel}'", 1)
+
+    def dispatch(
+        self, now: Optional[float] = None, force: bool = False, parallel: bool = True
+    ) -> int:
+        """
+        Send the digests that are due.
+
+        :param now: The current time. Defaults to time.time().
+        :param force: Send all pending notifications, regardless of the window. Failed
+            notifications still wait for their retry delay.
+        :param parallel: Send the channels in parallel. Must be False at interpreter exit,
+            when no new threads can be started for them.
+        :return: The number of notifications sent or attempted.
+        """
+        now = time.time() if now is None else now
+        groups = self._due_groups(now, force)
+        by_channel: Dict[str, List[Tuple[Dict[str, Any], List[OutboxItem]]]] = {}
+        for (channel, _, options), items in groups.items():
+            by_channel.setdefault(channel, []).append((json.loads(options), items))
+
+        if parallel and len(by_channel) > 1:
+            with ThreadPoolExecutor(max_workers=len(by_channel)) as executor:
+                # list() waits for all channels, and raises unexpected errors
+                list(executor.map(self._send_channel, by_channel.keys(), by_channel.values()))
+        else:
+            for channel, channel_groups in by_channel.items():
+                self._send_channel(channel, channel_groups)
+
+        if groups:
+            self.outbox.purge(self.keep_days)
+        return sum(len(items) for items in groups.values())
+
+
+class BackgroundDispatcher:
+    """
+    Runs a Dispatcher in a background thread, so notifications are sent without holding up
+    the thread queueing them. The dispatcher runs every `interval` seconds, and at once
+    when woken. Pending notifications are sent on a last, forced dispatch when stopped,
+    which also happens at interpreter exit if stop was not called. The last dispatch sends
+    the channels one after another, as the thread pool is shut down by then. Notifications that
+    could not be sent stay in the outbox for the next dispatch.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        interval: float = DEFAULT_INTERVAL,
+        timeout: float = DEFAULT_STOP_TIMEOUT,
+        logger: logging.Logger = logging.getLogger(__name__),
+    ):
+        """
+        :param dispatcher: The dispatcher to run.
+        :param interval: Seconds between dispatches when not woken.
+        :param timeout: Seconds stop waits for the last dispatch, unless told otherwise.
+        :param logger: Logger instance.
+        """
+        self.dispatcher = dispatcher
+        self.interval = interval
+        self.timeout = timeout
+        self.logger = logger
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._stopping = False
+        # Set by stop, whose flush may run at interpreter exit
+        self._final = False
+        # Dispatches asked for, and the last one done, to let flush wait for its dispatch
+        self._requested = 0
+        self._completed = 0
+        self._force = False
+        self._condition = threading.Condition()
+
+    def start(self):
+        """
+        Start the background thread, if it is not running.
+        """
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._final = False
+            self._thread = threading.Thread(
+                target=self._run, name="notification-dispatcher", daemon=True
+            )
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+                requested, force, final = self._requested, self._force, self._final
+                self._force = False
+            try:
+                self.dispatcher.dispatch(force=force, parallel=not final)
+            except Exception as e:
+                self.logger.error(f"Could not dispatch notifications: {e}")
+            with self._condition:
+                self._completed = requested
+                self._condition.notify_all()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def wake(self):
+        """
+        Dispatch now, without waiting for the dispatch.
+        """
+        self._wake.set()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Send all pending notifications that are not waiting to be retried, and wait for them.
+
+        :param timeout: Seconds to wait at most. No limit if None.
+        :return: True if the dispatch finished, False if it timed out or the thread is not
+            running.
+        """
+        with self._condition:
+            if self._thread is None:
+                return False
+            self._requested += 1
+            requested = self._requested
+            self._force = True
+            self._wake.set()
+            return self._condition.wait_for(
+                lambda: self._completed >= requested, timeout
+            )
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """
+        Flush the pending notifications, and stop the background thread.
+
+        :param timeout: Seconds to wait for the flush at most. Defaults to `timeout`.
+        :return: True if the flush finished in time. Otherwise the thread is left to finish
+            its dispatch, and is ended at interpreter exit.
+        """
+        atexit.unregister(self.stop)
+        if self._thread is None:
+            return True
+        with self._condition:
+            self._final = True
+        flushed = self.flush(self.timeout if timeout is None else timeout)
+        with self._condition:
+            self._stopping = True
+            thread, self._thread = self._thread, None
+        self._wake.set()
+        if not flushed:
+            self.logger.warning(
+                "Notifications still being sent, unsent ones are left in the outbox"
+            )
+            return False
+        thread.join()
+        self.dispatcher.close()
+        return True
@@ -1,9 +1,6 @@
 import os
-import arrow
 import re
-
-TODAY = arrow.now()
-NOW = TODAY.timestamp
+import time
 
 
 # Only keep files x days old
@@ -14,11 +11,12 @@ def remove_old_files(path, exp_days, re_pattern=None):
     :param re_pattern:     Optional. Pattern to match before deleting.
     """
     exp_seconds = exp_days * 24 * 3600
+    now = time.time()
 
     try:
         for f in os.listdir(path):
             f = os.path.join(path, f)
-            if os.stat(f).st_mtime < NOW - exp_seconds:
+            if os.stat(f).st_mtime < now - exp_seconds:
                 if os.path.isfile(f):
                     if re_pattern:
                         if re.search(re_pattern, os.path.basename(f)):
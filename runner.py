@@ -0,0 +1,224 @@
+import logging
+import multiprocessing
+import os
+import queue
+import traceback
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, NamedTuple, Optional, Tuple, Type
+
+from i_o_utilities import create_files, write_json_atomic
+from metrics import RunMetrics, write_prometheus_file
+from outbox import Dispatcher
+from scraper import Scraper
+
+LOGGER_NAME = "runner"
+# Constructor arguments holding files a site writes to
+STATE_FILE_ARGS = (
+    "elements_out_file",
+    "history_file",
+    "error_history_file",
+    "validators_file",
+    "search_cache_file",
+    "short_url_cache_file",
+)
+
+Registry = Dict[str, Tuple[Type[Scraper], Dict[str, Any]]]
+
+
+class SiteResult(NamedTuple):
+    site: str
+    success: bool
+    exit_code: Optional[int]
+    error: Optional[str]
+    metrics: Optional[RunMetrics]
+
+
+def _site_kwargs(site: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    kwargs = dict(kwargs)
+    # Metrics are tagged with the registry key, so logs and emails use it too
+    kwargs.setdefault("site_name", site)
+    # Error emails are throttled per site, so each site needs its own history
+    kwargs.setdefault("error_history_file", f"./data/{site}/error_email.json")
+    # Caches are rewritten whole by each process, so sites sharing one would drop each
+    # other's entries
+    kwargs.setdefault("search_cache_file", f"./data/{site}/searches_cache.json")
+    kwargs.setdefault("short_url_cache_file", f"./data/{site}/short_urls.json")
+    return kwargs
+
+
+def _state_files(site: str, kwargs: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    kwargs = _site_kwargs(site, kwargs)
+    files = {arg: kwargs.get(arg) for arg in STATE_FILE_ARGS}
+    # A given shortener is used instead of short_url_cache_file
+    if kwargs.get("shortener") is not None:
+        files["short_url_cache_file"] = kwargs["shortener"].cache_file
+    return files
+
+
+def check_isolation(registry: Registry):
+    """
+    Check that no two sites write to the same state file, and that sites are named after
+    their registry key.
+
+    :param registry: Scraper class and constructor arguments, by site name.
+    :raise ValueError: If a file is shared, or a site_name differs from its key.
+    """
+    owners = {}
+    for site, (_, kwargs) in registry.items():
+        if kwargs.get("site_name", site) != site:
+            raise ValueError(
+                f"Site '{site}' has the site_name '{kwargs['site_name']}', which must match its key"
+            )
+        for filename in _state_files(site, kwargs).values():
+            if not filename:
+                continue
+            path = os.path.abspath(os.path.expanduser(filename))
+            if path in owners and owners[path] != site:
+                raise ValueError(
+                    f"Sites '{owners[path]}' and '{site}' share the state file '{filename}'"
+                )
+            owners[path] = site
+
+
+def _run_site(
+    site: str,
+    scraper_class: Type[Scraper],
+    kwargs: Dict[str, Any],
+    log_queue: multiprocessing.Queue,
+    result_queue: multiprocessing.Queue,
+):
+    """
+    Worker process entry point: run one site through Scraper.main, with logs sent to the
+    parent, and report the outcome and metrics back.
+    """
+    logger = logging.getLogger(f"{LOGGER_NAME}.{site}")
+    logger.handlers = [QueueHandler(log_queue)]
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    metrics = RunMetrics(site)
+    exit_code = None
+    error = None
+    try:
+        scraper = scraper_class(**{**kwargs, "logger": logger, "metrics": metrics})
+        try:
+            scraper.main()
+        finally:
+            scraper.close()
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        error = traceback.format_exc()
+        logger.error(error)
+    result_queue.put((site, exit_code, error, metrics.summary()))
+
+
+def _record_result(
+    result: tuple,
+    results: Dict[str, SiteResult],
+    running: Dict[str, multiprocessing.Process],
+):
+    site, exit_code, error, summary = result
+    last_run_success = summary["gauges"].get("last_run_success", {}).get("", 0)
+    success = error is None and exit_code in (None, 0) and bool(last_run_success)
+    results[site] = SiteResult(
+        site, success, exit_code, error, RunMetrics.from_summary(summary)
+    )
+    running.pop(site).join()
+
+
+def run_sites(
+    registry: Registry,
+    processes: Optional[int] = None,
+    logger: logging.Logger = logging.getLogger(__name__),
+    json_file: Optional[str] = None,
+    prometheus_file: Optional[str] = None,
+    mp_context: Optional[str] = None,
+    dispatcher: Optional[Dispatcher] = None,
+) -> Dict[str, SiteResult]:
+    """
+    Run many scrapers, each in its own process, with at most `processes` at a time. A crash
+    in one site does not affect the others. Logs of all sites are handled by the handlers
+    of `logger` in this process, and metrics are collected here.
+
+    :param registry: Scraper class and constructor arguments, by site name. The logger and
+        metrics arguments are set by the runner, and site_name defaults to the key. Sites
+        get their own error email history, searches cache and short URL cache, unless
+        error_history_file, search_cache_file or short_url_cache_file is given.
+    :param processes: Maximum number of concurrent processes. Defaults to the number of CPUs.
+    :param logger: Logger whose handlers receive the log records of all sites.
+    :param json_file: Path to write the JSON summary of all sites' metrics to.
+    :param prometheus_file: Path to write the Prometheus textfile of all sites' metrics to.
+    :param mp_context: The multiprocessing start method. Defaults to the platform default.
+    :param dispatcher: Dispatcher of the outbox the sites send notifications through, called
+        once all sites are done. Digests still inside their window wait for the next call.
+    :return: The result of each site.
+    """
+    check_isolation(registry)
+    ctx = multiprocessing.get_context(mp_context)
+    processes = processes or os.cpu_count() or 1
+    log_queue = ctx.Queue()
+    result_queue = ctx.Queue()
+    listener = QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    listener.start()
+
+    pending = list(registry.items())
+    running: Dict[str, multiprocessing.Process] = {}
+    results: Dict[str, SiteResult] = {}
+    try:
+        while pending or running:
+            while pending and len(running) < processes:
+                site, (scraper_class, kwargs) = pending.pop(0)
+                process = ctx.Process(
+                    target=_run_site,
+                    name=f"scraper-{site}",
+                    args=(site, scraper_class, _site_kwargs(site, kwargs), log_queue, result_queue),
+                )
+                process.start()
+                running[site] = process
+
+            try:
+                _record_result(result_queue.get(timeout=0.5), results, running)
+            except queue.Empty:
+                pass
+
+            dead = [site for site, process in running.items() if not process.is_alive()]
+            if dead:
+                # Results are flushed before a worker exits, so they are readable by now
+                while True:
+                    try:
+                        _record_result(result_queue.get_nowait(), results, running)
+                    except queue.Empty:
+                        break
+                for site in dead:
+                    if site in running:
+                        process = running.pop(site)
+                        process.join()
+                        message = f"Worker for '{site}' crashed with exit code {process.exitcode}"
+                        logger.error(message)
+                        results[site] = SiteResult(site, False, process.exitcode, message, None)
+    finally:
+        for process in running.values():
+            process.terminate()
+        listener.stop()
+
+    if dispatcher is not None:
+        try:
+            dispatcher.dispatch()
+        except Exception as e:
+            logger.error(f"Could not dispatch notifications: {e}")
+        finally:
+            dispatcher.close()
+
+    all_metrics = [result.metrics for result in results.values() if result.metrics]
+    if json_file:
+        create_files(json_file)
+        write_json_atomic(json_file, {m.site: m.summary() for m in all_metrics})
+    if prometheus_file:
+        write_prometheus_file(prometheus_file, *all_metrics)
+    failed = [site for site, result in results.items() if not result.success]
+    logger.info(
+        f"Finished {len(results)} sites"
+        + (f", failed: {', '.join(failed)}" if failed else "")
+    )
+    return results
@@ -0,0 +1,166 @@
+import logging
+import random
+import signal
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from outbox import Dispatcher
+from scraper import Scraper
+
+DEFAULT_INTERVAL = 15 * 60
+DEFAULT_JITTER = 0.1
+DEFAULT_TICK = 5
+
+
+class ScraperDaemon:
+    """
+    Long-running scheduler hosting many Scraper instances in one process. Each search runs
+    on its own interval, set by an `interval` (in seconds) on the search in searches.yaml,
+    or the interval given for its scraper. Scrapers are kept between runs, so connections,
+    caches and stored state stay warm. Every run goes through Scraper.main, with the usual
+    error emails.
+
+    Usage:
+        daemon = ScraperDaemon()
+        daemon.add(MyScraper(...), interval=600)
+        daemon.run_forever()
+    """
+
+    def __init__(
+        self,
+        jitter: float = DEFAULT_JITTER,
+        tick: float = DEFAULT_TICK,
+        dispatcher: Optional[Dispatcher] = None,
+        logger: logging.Logger = logging.getLogger(__name__),
+    ):
+        """
+        :param jitter: Random spread of intervals, as a fraction of the interval.
+        :param tick: Seconds between checks for due searches.
+        :param dispatcher: Dispatcher of the outbox the scrapers send notifications through.
+            Called every tick, and once more, ignoring its window, when the daemon stops.
+        :param logger: Logger instance.
+        """
+        self.jitter = jitter
+        self.tick = tick
+        self.dispatcher = dispatcher
+        self.logger = logger
+        self._scrapers: List[Tuple[Scraper, float]] = []
+        # (scraper index, search URL) -> time the search is due
+        self._due: Dict[Tuple[int, str], float] = {}
+        # Scraper index -> time to read the searches again, after failing to read them
+        self._setup_retry: Dict[int, float] = {}
+        self._stop = threading.Event()
+
+    def add(self, scraper: Scraper, interval: float = DEFAULT_INTERVAL) -> "ScraperDaemon":
+        """
+        Add a scraper to the daemon.
+
+        :param scraper: The scraper.
+        :param interval: Seconds between runs of searches without an interval of their own.
+        :return: The daemon.
+        """
+        self._scrapers.append((scraper, interval))
+        return self
+
+    def _next_due(self, now: float, interval: float) -> float:
+        return now + interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def run_pending(self, now: Optional[float] = None) -> int:
+        """
+        Run the searches that are due, grouped into one run per scraper.
+
+        :param now: The current time. Defaults to time.time().
+        :return: The number of scraper runs.
+        """
+        now = time.time() if now is None else now
+        runs = 0
+        for index, (scraper, default_interval) in enumerate(self._scrapers):
+            if self._stop.is_set():
+                break
+            if self._setup_retry.get(index, 0) > now:
+                continue
+            try:
+                searches = scraper._i_o_setup()
+            except Exception as e:
+                self.logger.error(f"Could not read searches of {scraper.site_name}: {e}")
+                # A full run fails the same way, and reports it with the usual error emails
+                self._main(scraper, None)
+                self._setup_retry[index] = self._next_due(now, default_interval)
+                runs += 1
+                continue
+            self._setup_retry.pop(index, None)
+
+            due = []
+            configured = set()
+            for search in searches:
+                key = (index, search["search_url"])
+                configured.add(key)
+                interval = search.get("interval", default_interval)
+                if key not in self._due:
+                    # Spread the first runs, so new searches do not all start at once
+                    self._due[key] = now + random.uniform(0, self.jitter * interval)
+                if self._due[key] <= now:
+                    due.append(search)
+                    self._due[key] = self._next_due(now, interval)
+
+            # Forget searches removed from the config
+            for key in [key for key in self._due if key[0] == index]:
+                if key not in configured:
+                    del self._due[key]
+
+            if due:
+                self._run(scraper, due, searches)
+                runs += 1
+        return runs
+
+    def _run(self, scraper: Scraper, due: List[dict], searches: List[dict]):
+        self.logger.info(
+            f"Running {len(due)} of {len(searches)} searches for {scraper.site_name}"
+        )
+        # A full run also cleans up state of removed searches
+        self._main(scraper, None if len(due) == len(searches) else due)
+
+    def _main(self, scraper: Scraper, searches: Optional[List[dict]]):
+        try:
+            scraper.main(searches)
+        except SystemExit as e:
+            # main and email_errors exit on failed error emails, which must not stop the daemon
+            self.logger.error(f"Run of {scraper.site_name} exited with code {e.code}")
+        except Exception as e:
+            self.logger.error(f"Run of {scraper.site_name} failed: {e}")
+
+    def _dispatch(self, force: bool = False):
+        if self.dispatcher is None:
+            return
+        try:
+            self.dispatcher.dispatch(force=force)
+        except Exception as e:
+            self.logger.error(f"Could not dispatch notifications: {e}")
+
+    def run_forever(self):
+        """
+        Run due searches until stop() is called, or the process gets SIGINT or SIGTERM.
+        """
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *args: self.stop())
+
+        self.logger.info(f"Starting daemon with {len(self._scrapers)} scrapers")
+        while not self._stop.is_set():
+            self.run_pending()
+            self._dispatch()
+            self._stop.wait(self.tick)
+
+        self._dispatch(force=True)
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+        for scraper, _ in self._scrapers:
+            scraper.close()
+        self.logger.info("Daemon stopped")
+
+    def stop(self):
+        """
+        Stop the daemon after the current run.
+        """
+        self._stop.set()
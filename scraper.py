@@ -1,33 +1,52 @@
+from __future__ import annotations
+
 import json
-import pyshorteners
+import hashlib
 import notify
-import arrow
-import mechanicalsoup as ms
 import requests
-import os
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 import logging
-from urllib.parse import urlparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextlib import closing
+from itertools import islice
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
-from bs4 import BeautifulSoup
-import yaml
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Iterator, Tuple, Union, Set
+import credentials
 from email_errors import email_errors
+import time
 import traceback
 
+from element_store import ElementStore, open_element_store
+from fetch import FetchError, Fetcher
 from i_o_utilities import create_files
+from metrics import NULL_METRICS, RunMetrics
+import outbox as notification_outbox
+from search_config import DEFAULT_CACHE_FILE as DEFAULT_SEARCH_CACHE_FILE
+from search_config import InvalidSearchConfig, SearchConfigCache, is_valid_url
+from shortener import DEFAULT_CACHE_FILE as DEFAULT_SHORT_URL_CACHE_FILE
+from shortener import UrlShortener
+import text_diff
+from validator_cache import NotModified, ValidatorCache
+
+# Only needed for html pages, so imported where they are used
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup, SoupStrainer
 
 DEFAULT_HISTORY_FILE = "./logs/history.txt"
 DEFAULT_SEARCHES_FILE = "./input/searches.yaml"
 DEFAULT_ELEMENTS_OUT_FILE = "./data/elements.json"
 DEFAULT_LOG_FILE = "./logs/all.log"
+DEFAULT_VALIDATORS_FILE = "./data/validators.json"
+DEFAULT_ERROR_HISTORY_FILE = "./data/error_email.json"
 
 HEADERS = {
     "accept": "*/*",
     "accept-encoding": "gzip, deflate, br, zstd",
     "accept-language": "nb,no;q=0.9,en;q=0.8,es;q=0.7",
     "dnt": "1",
-    "if-none-match": '"46:1:1:349:20250219144056747"',
     "priority": "u=1, i",
     "sec-ch-ua": '"Chromium";v="133", "Not(A:Brand";v="99"',
     "sec-ch-ua-mobile": "?0",
@@ -38,8 +57,8 @@ HEADERS = {
     "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36",
 }
 
-BROWSER = ms.StatefulBrowser()
-BROWSER.set_user_agent("Mozilla/5.0")
+DEFAULT_TIMEOUT = (10, 30)  # (connect, read) in seconds
+DIGEST_CHUNK_SIZE = 64 * 1024
 
 
 class Scraper(ABC):
@@ -47,6 +66,14 @@ class Scraper(ABC):
     An abstract base class for web scrapers.
     """
 
+    MAX_PAGES = 15
+    # Parser backend for html pages
+    PARSER = "lxml"
+    # Parts of html pages to parse, as keyword arguments for a bs4 SoupStrainer, e.g.
+    # {"name": ["ul", "nav"], "attrs": {"class": ["results", "pagination"]}}.
+    # Must cover everything _get_elements and _get_next_page look at. None parses the whole page.
+    PARSE_ONLY: Optional[Dict[str, Any]] = None
+
     def __init__(
         self,
         site_name: str,
@@ -66,15 +93,63 @@ class Scraper(ABC):
         email_notifications: bool = True,
         email_pwd_file: str = None,
         include_changes: bool = True,
+        concurrency: int = 1,
+        max_per_host: Optional[int] = None,
+        timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+        rate_limit: Optional[float] = None,
+        rate_burst: int = 1,
+        retries: int = 3,
+        failure_threshold: int = 3,
+        validators_file: Optional[str] = None,
+        element_store: Optional[ElementStore] = None,
+        streaming_diff: bool = False,
+        shortener: Optional[UrlShortener] = None,
+        short_url_cache_file: Optional[str] = DEFAULT_SHORT_URL_CACHE_FILE,
+        metrics: Optional[RunMetrics] = None,
+        error_history_file: str = DEFAULT_ERROR_HISTORY_FILE,
+        search_cache_file: Optional[str] = DEFAULT_SEARCH_CACHE_FILE,
+        outbox: Optional[notification_outbox.NotificationOutbox] = None,
+        sender_email: Optional[str] = None,
+        background_notifications: bool = False,
+        notification_timeout: float = notification_outbox.DEFAULT_STOP_TIMEOUT,
     ):
         # TODO Extract log file from logger, and send these in error email
         self.site_name = site_name
         self.secrets_file = secrets_file
         self.log_file = log_file
         self.elements_out_file = elements_out_file
+        self.element_store = element_store or open_element_store(elements_out_file)
+        self.streaming_diff = streaming_diff
+        self.shortener = shortener or UrlShortener(cache_file=short_url_cache_file, logger=logger)
+        self.metrics = metrics or NULL_METRICS
         self.history_file = history_file
+        self.error_history_file = error_history_file
         self.searches_file = searches_file
+        self.search_config = SearchConfigCache(search_cache_file, logger=logger)
+        self._files_created = False
         self.email = email
+        # Notifications are sent by whoever dispatches the outbox, if one is given, or by a
+        # background thread of this scraper with background_notifications
+        self.outbox = outbox
+        self._notifier: Optional[notification_outbox.BackgroundDispatcher] = None
+        if background_notifications:
+            if self.outbox is not None:
+                # The background dispatcher would also send, and digest, notifications of
+                # other scrapers sharing the outbox
+                logger.error("background_notifications can not be used with a given outbox")
+                raise Exception("background_notifications can not be used with a given outbox")
+            self.outbox = notification_outbox.NotificationOutbox()
+            self._notifier = notification_outbox.BackgroundDispatcher(
+                # Scrapers of other sites may use the same outbox file
+                notification_outbox.Dispatcher(
+                    self.outbox, window=0, site=site_name, logger=logger
+                ),
+                timeout=notification_timeout,
+                logger=logger,
+            )
+        # Channel -> outbox id, of the notifications of the last alert
+        self._notification_ids: Dict[str, int] = {}
+        self.sender_email = sender_email or email
         self.max_notif_entries = max_notif_entries
         self.email_html = email_html
         self.logger = logger
@@ -85,6 +160,93 @@ class Scraper(ABC):
         self.email_notifications = email_notifications
         self.email_pwd_file = email_pwd_file
         self.include_changes = include_changes
+        self.concurrency = max(1, concurrency)
+        self.max_per_host = max_per_host or self.concurrency
+        self.timeout = timeout
+        self.fetcher = Fetcher(
+            max_per_host=self.max_per_host,
+            rate=rate_limit,
+            burst=rate_burst,
+            retries=retries,
+            failure_threshold=failure_threshold,
+            logger=logger,
+            metrics=self.metrics,
+        )
+        # Search URL -> reason, for searches skipped in the current run
+        self._skipped_searches: Dict[str, str] = {}
+        # Search URLs that failed since the error history was last reset, with None for a
+        # full run failing outside of a search, like a broken searches file
+        self._failing_searches: Set[Optional[str]] = set()
+        self._session: Optional[requests.Session] = None
+        self._session_lock = threading.Lock()
+        self._soup_config: Optional[Dict[str, Any]] = None
+        # Conditional GETs are only sent when a file for the validators is given
+        self.validator_cache = (
+            ValidatorCache(validators_file) if validators_file else None
+        )
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        The HTTP session of this scraper, created on first use. Connections are kept
+        alive and pooled, with room for one connection per concurrent request to a host.
+
+        :return: The requests session.
+        """
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_maxsize=self.max_per_host)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+        return self._session
+
+    def _parse_only(self) -> Optional[SoupStrainer]:
+        """
+        Get the strainer limiting which parts of html pages are parsed. Override for
+        filters that can not be expressed through PARSE_ONLY.
+
+        :return: The strainer, or None to parse whole pages.
+        """
+        if self.PARSE_ONLY is None:
+            return None
+        from bs4 import SoupStrainer
+
+        return SoupStrainer(**self.PARSE_ONLY)
+
+    @property
+    def soup_config(self) -> Dict[str, Any]:
+        """
+        Keyword arguments for BeautifulSoup when parsing html pages.
+
+        :return: The soup config.
+        """
+        if self._soup_config is None:
+            soup_config = {"features": self.PARSER}
+            parse_only = self._parse_only()
+            if parse_only is not None:
+                soup_config["parse_only"] = parse_only
+            self._soup_config = soup_config
+        return self._soup_config
+
+    def close(self):
+        """
+        Close the HTTP session and its pooled connections. With background notifications,
+        first wait up to `notification_timeout` seconds for pending notifications to be sent.
+        """
+        if self._notifier is not None:
+            self._notifier.stop()
+            for status in self.delivery_status().values():
+                if status.status != notification_outbox.SENT:
+                    self.logger.warning(
+                        f"{status.channel} notification {status.status} after "
+                        f"{status.attempts} attempts: {status.last_error}"
+                    )
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
 
     def _is_valid_url(self, url: str) -> bool:
         """
@@ -93,49 +255,29 @@ class Scraper(ABC):
         :param url: The URL to check.
         :return: True if the URL is valid, False otherwise.
         """
-        try:
-            result = urlparse(url)
-            return all([result.scheme, result.netloc])
-        except ValueError:
-            return False
+        return is_valid_url(url)
 
     def _compare_results(
-        self, cur_elements: Dict[str, Any]
+        self,
+        cur_elements: Dict[str, Any],
+        scope: Optional[str] = None,
+        reported: Optional[Set[str]] = None,
     ) -> Optional[List[Dict[str, Any]]]:
         """
         Compare current elements with previous elements and return new elements.
 
         :param cur_elements: The current elements.
+        :param scope: Only replace the stored elements of this search URL. All stored elements if None.
+        :param reported: Keys already reported during this run, which are not reported
+            again. New keys are added to it.
         :return: A list of new elements, or None if no new elements are found.
         """
         self.logger.info("Starting compare_results function")
-        prev_elements = {}
-        with open(self.elements_out_file, "r+") as fp:
-            if fp.read() != "":
-                fp.seek(0)
-                try:
-                    prev_elements = json.load(fp)
-                except Exception as e:
-                    os.remove(self.elements_out_file)
-                    self.logger.error("Could not read json. Deleting file.")
-                    raise IOError("Could not read json. Deleting file.") from e
-
-        with open(self.elements_out_file, "w+") as fp:
-            json.dump(cur_elements, fp)
-
-        new = []
-        for key in cur_elements:
-            add = False
-            # Add changed elements if self.include_changes is True
-            if self.include_changes and cur_elements.get(key) != prev_elements.get(key):
-                add = True
-            if key not in prev_elements:
-                add = True
-            if add:
-                new.append(cur_elements.get(key))
-
-        self.logger.debug(f"Previous elements: {prev_elements}")
-        self.logger.debug(f"Current elements: {cur_elements}")
+        with self.metrics.timer("diff"):
+            new, changed, removed = self._diff_elements(cur_elements, scope, reported)
+        self.metrics.incr("elements_new", len(new))
+        self.metrics.incr("elements_stored", len(changed))
+        self.metrics.incr("elements_removed", len(removed))
 
         if len(new) == 0:
             self.logger.info("No new elements found")
@@ -144,46 +286,97 @@ class Scraper(ABC):
         self.logger.info(f"Found {len(new)} new elements")
         return new
 
+    def _diff_elements(
+        self,
+        cur_elements: Dict[str, Any],
+        scope: Optional[str],
+        reported: Optional[Set[str]],
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any], Set[str]]:
+        """
+        Diff current elements against the element store, and write the changes to it.
+
+        :param cur_elements: The current elements.
+        :param scope: Only replace the stored elements of this search URL. All stored elements if None.
+            Elements stored by another search are left to that search.
+        :param reported: Keys already reported during this run.
+        :return: The new elements to report, the elements written, and the keys deleted.
+        """
+        try:
+            prev_elements = self.element_store.get_many(cur_elements)
+        except IOError as e:
+            self.logger.error(f"Could not read the stored elements: {e}")
+            raise
+
+        new = []
+        changed = {}
+        for key, element in cur_elements.items():
+            if scope is not None and key in prev_elements:
+                owner = self.element_store.scope_of(prev_elements[key])
+                if owner is not None and owner != scope:
+                    # Also found by another search, which owns the stored element
+                    continue
+            is_new = key not in prev_elements
+            if is_new or element != prev_elements[key]:
+                changed[key] = element
+                # Add changed elements if self.include_changes is True
+                if is_new or self.include_changes:
+                    if reported is None:
+                        new.append(element)
+                    elif key not in reported:
+                        reported.add(key)
+                        new.append(element)
+
+        removed = self.element_store.keys(scope) - cur_elements.keys()
+        if scope is None:
+            # Elements of skipped searches are unknown this run, not gone
+            for skipped in self._skipped_searches:
+                removed -= self.element_store.keys(skipped)
+        self.element_store.write(changed, removed)
+        self.logger.debug(
+            f"Stored {len(changed)} changed and removed {len(removed)} elements"
+        )
+
+        self.logger.debug(f"Previous elements: {prev_elements}")
+        self.logger.debug(f"Current elements: {cur_elements}")
+        return new, changed, removed
+
     def _i_o_setup(self) -> List[Dict[str, str]]:
         """
-        Set up input/output files and read search parameters.
+        Set up input/output files and read search parameters. The searches file is only
+        parsed again when it has changed, so edits take effect on the next run.
 
         :return: A list of search parameters.
         """
-        self.logger.info("Starting i_o_setup function")
+        # Called on every poll of the daemon, so not worth an info line
+        self.logger.debug("Starting i_o_setup function")
         if not Path(self.searches_file).exists():
             self.logger.error(f"Input file '{self.searches_file}' does not exist.")
             raise Exception(f"Input file '{self.searches_file}' does not exist.")
 
-        create_files(self.elements_out_file, self.history_file, self.searches_file)
-
-        with open(self.searches_file, "r") as fp:
-            search_data = yaml.safe_load(fp)
-
-        search_dict = []
-        for search in search_data.get("searches", []):
-            search_url = search.get("search_url")
-            display_url = search.get(
-                "display_url", search_url
-            )  # Set to search_url if display_url is not provided
-            search_title = search.get("title")
-            if not self._is_valid_url(search_url) or not self._is_valid_url(
-                display_url
-            ):
-                self.logger.error(f"Invalid URL(s) found: {search_url}, {display_url}")
-                raise Exception(f"Invalid URL(s) found: {search_url}, {display_url}")
-
-            search_dict.append(
-                {
-                    "search_url": search_url,
-                    "display_url": display_url,
-                    "search_title": search_title,
-                }
-            )
+        if not self._files_created:
+            create_files(self.elements_out_file, self.history_file)
+            self._files_created = True
+
+        try:
+            search_dict = self.search_config.load(self.searches_file)
+        except InvalidSearchConfig as e:
+            self.logger.error(str(e))
+            raise Exception(str(e))
 
-        self.logger.info("Finished i_o_setup function")
+        self.logger.debug("Finished i_o_setup function")
         return search_dict
 
+    def _element_url(self, element: Dict[str, Any]) -> str:
+        """
+        Get the URL linked to for an element.
+
+        :param element: The element.
+        :return: The element's href, or the URL of its search if it has none.
+        """
+        if "href" in element:
+            return element["href"]
+        return element["search"]["visit_url"]
+
     def _alert_write_new(
         self,
         elements: List[Dict[str, Any]],
@@ -200,20 +393,23 @@ class Scraper(ABC):
         notify_text = f"Det er blitt lagt til {len(elements)} nye annonse(r) på {self.site_name}-søket ditt.\n\n"
 
         archive_links = ""
-        for i in range(0, len(elements)):
-            element = elements[i]
-            if "href" in element:
-                url = element["href"]
-            else:
-                url = element["search"]["visit_url"]
-            archive_links += "\n– {}".format(url)
-            element_url = pyshorteners.Shortener().tinyurl.short(url)
-            if i >= self.max_notif_entries:
-                continue
-
-            search_url = pyshorteners.Shortener().tinyurl.short(
-                element["search"]["visit_url"]
+        for element in elements:
+            archive_links += "\n– {}".format(self._element_url(element))
+
+        # Only shorten the links that are rendered, all in one batch
+        shown = elements[: self.max_notif_entries]
+        backend_calls = self.shortener.backend_calls
+        with self.metrics.timer("shorten"):
+            short_urls = self.shortener.short_many(
+                [self._element_url(element) for element in shown]
+                + [element["search"]["visit_url"] for element in shown]
+                + [search["display_url"] for search in searches]
             )
+        self.metrics.incr("shortener_calls", self.shortener.backend_calls - backend_calls)
+
+        for element in shown:
+            element_url = short_urls[self._element_url(element)]
+            search_url = short_urls[element["search"]["visit_url"]]
             element_link = f'<a href="{element_url}">{element["title"]}</a>'
             search_link = (
                 f"<a href=\"{search_url}\">søk: '{element['search']['name']}'</a>"
@@ -228,64 +424,287 @@ class Scraper(ABC):
                 f"\n... og {len(elements) - self.max_notif_entries} annonse(r) til.\n"
             )
 
-        short_urls = [
-            [
-                pyshorteners.Shortener().tinyurl.short(search["display_url"]),
-                search["search_title"],
-            ]
-            for search in searches
-        ]
         notify_text += "\n\nLenke til søk:\n"
 
-        for url, name in short_urls:
-            notify_text += f"<a href=\"{url}\">'{name}'</a>\n"
+        for search in searches:
+            url = short_urls[search["display_url"]]
+            notify_text += f"<a href=\"{url}\">'{search['search_title']}'</a>\n"
 
         notify_text += f"\nVennlig hilsen,\n{self.site_name}-roboten"
 
         if self.pushover_notifications:
-            if (
-                not (self.pushover_token and self.pushover_user_key)
-                and not self.secrets_file
-            ):
+            # Resolved once per process, and shared with notify
+            try:
+                credentials.pushover_credentials(
+                    self.pushover_token, self.pushover_user_key, self.secrets_file
+                )
+            except credentials.CredentialNotFound:
                 self.logger.error("Pushover api token and user key required")
                 raise Exception("Pushover api token and user key required")
-            notify.push_notification(
-                notify_text,
-                self.pushover_token,
-                self.pushover_user_key,
-                self.secrets_file,
-            )
-        if self.email_notifications:
-            notify.mail(
-                self.email,
-                subj,
-                notify_text,
-                html=self.email_html,
-                pwd_file=self.email_pwd_file,
-            )
+
+        if self.outbox is not None:
+            self._enqueue_notifications(subj, notify_text)
+        else:
+            if self.pushover_notifications:
+                with self.metrics.timer("notify_pushover"):
+                    notify.push_notification(
+                        notify_text,
+                        self.pushover_token,
+                        self.pushover_user_key,
+                        self.secrets_file,
+                    )
+            if self.email_notifications:
+                with self.metrics.timer("notify_email"):
+                    notify.mail(
+                        self.email,
+                        subj,
+                        notify_text,
+                        self.sender_email,
+                        html=self.email_html,
+                        pwd_file=self.email_pwd_file,
+                    )
         if self.history_file:
             self._write_with_timestamp(archive_links, self.history_file)
+        # Only a cache, so failing to save it must not fail the alert
+        try:
+            self.shortener.save()
+        except OSError as e:
+            self.logger.warning(f"Could not save short URL cache: {e}")
         self.logger.info("Finished alert_write_new function")
 
-    def _run_scraper(self):
+    def _enqueue_notifications(self, subj: str, notify_text: str):
         """
-        The wrapper function to run the scraper.
+        Queue the notifications of an alert in the outbox, on all channels at once, and wake
+        the background dispatcher if there is one.
+
+        :param subj: The subject.
+        :param notify_text: The text.
         """
-        self.logger.info("Starting main function")
+        notifications = []
+        if self.pushover_notifications:
+            notifications.append(
+                {
+                    "channel": notification_outbox.PUSHOVER,
+                    "recipient": self.pushover_user_key or "",
+                    "subject": subj,
+                    "body": notify_text,
+                    "html": True,
+                    "site": self.site_name,
+                    "options": {
+                        "token": self.pushover_token,
+                        "secrets_file": self.secrets_file,
+                    },
+                }
+            )
+        if self.email_notifications:
+            notifications.append(
+                {
+                    "channel": notification_outbox.EMAIL,
+                    "recipient": self.email,
+                    "subject": subj,
+                    "body": notify_text,
+                    "html": self.email_html,
+                    "site": self.site_name,
+                    "options": {
+                        "sender_email": self.sender_email,
+                        "pwd_file": self.email_pwd_file,
+                    },
+                }
+            )
+        if not notifications:
+            return
+        with self.metrics.timer("notify_enqueue"):
+            ids = self.outbox.enqueue_many(notifications)
+        self._notification_ids = {
+            notification["channel"]: id for notification, id in zip(notifications, ids)
+        }
+        self.metrics.incr("notifications_queued", len(ids))
+        if self._notifier is not None:
+            self._notifier.wake()
 
-        searches = self._i_o_setup()
-        cur_elements = {}
+    def delivery_status(self) -> Dict[str, notification_outbox.DeliveryStatus]:
+        """
+        Get the delivery status of the notifications of the last alert, when sent through
+        an outbox.
 
-        for search in searches:
-            cur_elements = self._process_page(
+        :return: The status of each channel, by channel.
+        """
+        if self.outbox is None or not self._notification_ids:
+            return {}
+        statuses = self.outbox.statuses(list(self._notification_ids.values()))
+        return {
+            channel: statuses[id]
+            for channel, id in self._notification_ids.items()
+            if id in statuses
+        }
+
+    def _process_search(self, search: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """
+        Process all pages of a search.
+
+        :param search: The search parameters.
+        :return: The elements found by the search, or None if the search was skipped.
+        """
+        try:
+            return self._process_page(
                 search["search_url"],
-                cur_elements,
+                {},
                 search,
-                max_pages=15,
+                max_pages=self.MAX_PAGES,
                 page_num=1,
             )
+        except FetchError as e:
+            self._skip_search(search, e)
+            return None
+
+    def _skip_search(self, search: Dict[str, str], error: FetchError):
+        """
+        Mark a search as skipped for this run. Its stored elements are kept as they are.
+
+        :param search: The search parameters.
+        :param error: The error the search failed with.
+        """
+        self.logger.error(f"Skipping search '{search['search_title']}': {error}")
+        self.metrics.incr("searches_skipped", 1, search["search_title"])
+        self._skipped_searches[search["search_url"]] = str(error)
+
+    def _iter_search_elements(
+        self, searches: List[Dict[str, str]]
+    ) -> Iterator[Tuple[Dict[str, str], Dict[str, Any]]]:
+        """
+        Process searches, yielding the elements of each search in the order of `searches`.
+        With concurrency > 1, up to `concurrency` searches are processed ahead in a thread pool.
 
-        new_elements = self._compare_results(cur_elements)
+        :param searches: The list of search parameters.
+        :return: An iterator of (search, elements) tuples. Elements are None for skipped searches.
+        """
+        if self.concurrency == 1 or len(searches) <= 1:
+            for search in searches:
+                yield search, self._process_search(search)
+            return
+
+        self.logger.info(
+            f"Running {len(searches)} searches with concurrency {self.concurrency}"
+        )
+        executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix=f"{self.site_name}-search"
+        )
+        try:
+            remaining = iter(searches)
+            pending = deque(
+                (search, executor.submit(self._process_search, search))
+                for search in islice(remaining, self.concurrency)
+            )
+            while pending:
+                search, future = pending.popleft()
+                elements = future.result()
+                for next_search in islice(remaining, 1):
+                    pending.append(
+                        (next_search, executor.submit(self._process_search, next_search))
+                    )
+                yield search, elements
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _collect_elements(self, searches: List[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        Process all searches and merge their elements into one dictionary.
+
+        With concurrency > 1 the searches run in a thread pool, each into its own
+        dictionary. The dictionaries are merged in the order of `searches`, so the
+        result is the same as for a sequential run as long as `_get_attrs` only
+        stores elements under their keys.
+
+        :param searches: The list of search parameters.
+        :return: The merged elements dictionary.
+        """
+        cur_elements = {}
+        if self.concurrency == 1:
+            for search in searches:
+                try:
+                    cur_elements = self._process_page(
+                        search["search_url"],
+                        cur_elements,
+                        search,
+                        max_pages=self.MAX_PAGES,
+                        page_num=1,
+                    )
+                except FetchError as e:
+                    self._skip_search(search, e)
+            return cur_elements
+
+        with closing(self._iter_search_elements(searches)) as search_elements:
+            for _, elements in search_elements:
+                if elements is not None:
+                    cur_elements.update(elements)
+        return cur_elements
+
+    def _stream_compare(
+        self, searches: List[Dict[str, str]], prune_removed: bool = True
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Compare elements with the stored state one search at a time, flushing the state
+        after each search. Only the elements of a single search (or `concurrency` searches)
+        are held in memory at once, plus the new elements collected for the alert.
+
+        :param searches: The list of search parameters.
+        :param prune_removed: Delete stored elements of searches not in `searches`.
+        :return: A list of new elements, or None if no new elements are found.
+        """
+        outbox = []
+        reported = set()
+        with closing(self._iter_search_elements(searches)) as search_elements:
+            for search, elements in search_elements:
+                if elements is None:
+                    continue
+                new = self._compare_results(
+                    elements, scope=search["search_url"], reported=reported
+                )
+                outbox.extend(new or [])
+        if prune_removed:
+            self._prune_scopes({search["search_url"] for search in searches})
+        return outbox or None
+
+    def _prune_scopes(self, keep: Set[str]):
+        """
+        Delete the stored elements of searches that are no longer configured.
+
+        :param keep: The search URLs to keep elements for.
+        """
+        stale = self.element_store.scopes() - keep - {None}
+        deletes = set()
+        for scope in stale:
+            deletes |= self.element_store.keys(scope)
+        if deletes:
+            self.logger.info(
+                f"Removing {len(deletes)} elements of {len(stale)} removed searches"
+            )
+            self.element_store.write({}, deletes)
+
+    def _run_scraper(self, searches: Optional[List[Dict[str, str]]] = None):
+        """
+        The wrapper function to run the scraper.
+
+        :param searches: Run only these searches, as returned by `_i_o_setup`. Stored elements
+            of other searches are left as they are. All configured searches if None.
+        """
+        self.logger.info("Starting main function")
+
+        self._skipped_searches = {}
+        self.fetcher.reset()
+        if self._notifier is not None:
+            # Also sends what earlier runs left in the outbox
+            self._notifier.start()
+        full_run = searches is None
+        if full_run:
+            searches = self._i_o_setup()
+        if self.streaming_diff or not full_run:
+            new_elements = self._stream_compare(searches, prune_removed=full_run)
+        else:
+            cur_elements = self._collect_elements(searches)
+            new_elements = self._compare_results(cur_elements)
+        if self.validator_cache is not None:
+            self.validator_cache.save(prune=full_run)
 
         if new_elements:
             self.logger.info(f"Found {len(new_elements)} new elements")
@@ -294,31 +713,98 @@ class Scraper(ABC):
                 searches,
             )
 
+        if self._skipped_searches:
+            skipped = "\n".join(
+                f"{url}: {reason}" for url, reason in self._skipped_searches.items()
+            )
+            self.logger.error(f"Skipped {len(self._skipped_searches)} searches:\n{skipped}")
+            raise Exception(f"Skipped {len(self._skipped_searches)} searches:\n{skipped}")
+
         self.logger.info("Finished main function")
 
-    def main(self):
+    def main(self, searches: Optional[List[Dict[str, str]]] = None):
         """
         The main function to run the scraper with error handling.
+
+        :param searches: Run only these searches. All configured searches if None.
         """
-        e = None
+        error = None
+        start = time.perf_counter()
         try:
-            self._run_scraper()
+            self._run_scraper(searches)
         except Exception as e:
-            e = e
+            # `e` is unbound when the except block ends, so keep the exception
+            error = e
             self.logger.error(traceback.format_exc())
+        self._record_run(time.perf_counter() - start, error is None)
+        if not self._track_failing(searches, error):
+            # Other searches are still failing, so their error history must stay
+            return
         try:
             email_errors(
-                e,
+                error,
                 self.email,
                 script=self.site_name,
-                history_file="./data/error_email.json",
+                history_file=self.error_history_file,
                 log_file=self.log_file,
                 logger=self.logger,
+                sender_email=self.sender_email,
+                pwd_file=self.email_pwd_file,
             )
         except Exception as e:
             self.logger.error(f"Error sending error email: {e}")
             exit(-1)
 
+    def _track_failing(
+        self, searches: Optional[List[Dict[str, str]]], error: Optional[Exception]
+    ) -> bool:
+        """
+        Keep track of the searches that failed since the error history was last reset. A
+        run of some searches only clears the failures of those searches, so a search that
+        keeps succeeding does not reset the history of one that keeps failing.
+
+        :param searches: The searches of the run. All configured searches if None.
+        :param error: The error of the run, if it failed.
+        :return: Whether to pass the outcome on to email_errors. False if the run succeeded,
+            but other searches are still failing.
+        """
+        skipped = set(self._skipped_searches)
+        if searches is None:
+            if error is None:
+                self._failing_searches.clear()
+            elif skipped:
+                # The other searches succeeded
+                self._failing_searches = set(skipped)
+            else:
+                self._failing_searches.add(None)
+        else:
+            ran = {search["search_url"] for search in searches}
+            if error is not None and not skipped:
+                self._failing_searches |= ran
+            else:
+                # Searches were read and run, so None is cleared as well
+                self._failing_searches -= (ran - skipped) | {None}
+                self._failing_searches |= skipped
+        return error is not None or not self._failing_searches
+
+    def _record_run(self, seconds: float, success: bool):
+        """
+        Record the outcome of a run in the metrics, and export them.
+
+        :param seconds: The duration of the run.
+        :param success: Whether the run completed without errors.
+        """
+        self.metrics.observe("run", seconds)
+        self.metrics.incr("runs")
+        if not success:
+            self.metrics.incr("runs_failed")
+        self.metrics.set("last_run_timestamp", time.time())
+        self.metrics.set("last_run_success", int(success))
+        try:
+            self.metrics.export()
+        except OSError as e:
+            self.logger.error(f"Could not export metrics: {e}")
+
     def _write_with_timestamp(self, links: str, filename: str):
         """
         Write links to a file with a timestamp.
@@ -327,10 +813,164 @@ class Scraper(ABC):
         :param filename: The file path to write to.
         """
 
-        timestamp = arrow.now().format("YYYY-MM-DD HH:mm:ss")
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
         with open(filename, "a") as fp:
             fp.write(f"{timestamp}{links}\n\n")
 
+    @property
+    def stream_responses(self) -> bool:
+        """
+        Whether response bodies are left unread by `_request`, for `_load_page` to consume
+        as a stream.
+
+        :return: False, as the base scraper always needs the whole body.
+        """
+        return False
+
+    def _request(self, page_url: str, headers: Dict[str, str]) -> requests.Response:
+        """
+        Send a GET request through the fetcher, which applies the per-host rate limit and
+        concurrency cap, and retries failed requests.
+
+        :param page_url: The URL to request.
+        :param headers: The request headers.
+        :return: The response.
+        :raise FetchError: If the request failed after all retries, or its host is skipped.
+        """
+        return self.fetcher.get(
+            self.session,
+            page_url,
+            headers=headers,
+            timeout=self.timeout,
+            stream=self.stream_responses,
+        )
+
+    def _load_page(self, response: requests.Response) -> Any:
+        """
+        Decode a response into the page passed on to `_get_elements`.
+
+        :param response: The response to decode.
+        :return: The decoded JSON if json_request is set, else the parsed html.
+        """
+        if self.json_request:
+            return response.json()
+        import mechanicalsoup as ms
+
+        ms.Browser.add_soup(response, self.soup_config)
+        return response.soup
+
+    def _fetch_page(
+        self,
+        page_url: str,
+        headers: Dict[str, str],
+        search: Optional[Dict[str, str]] = None,
+    ) -> Any:
+        """
+        Fetch and decode a page. If a validator cache is configured, the request is made
+        conditional, and a page answered with 304 is returned as a NotModified object.
+
+        :param page_url: The URL of the page to fetch.
+        :param headers: The request headers.
+        :param search: The search the page belongs to.
+        :return: The decoded page, or NotModified.
+        """
+        label = search["search_title"] if search else None
+        use_validators = self.validator_cache is not None and search is not None
+        conditional_headers = {}
+        if use_validators:
+            conditional_headers = self.validator_cache.conditional_headers(page_url, search)
+
+        with self.metrics.timer("fetch", label):
+            response = self._request(page_url, {**headers, **conditional_headers})
+        self.metrics.incr("pages_fetched", 1, label)
+        if use_validators:
+            if response.status_code == 304:
+                cached_page = self.validator_cache.not_modified(page_url)
+                if cached_page is not None:
+                    self.logger.debug(f"Page not modified: {page_url}")
+                    self.metrics.incr("pages_not_modified", 1, label)
+                    return cached_page
+                with self.metrics.timer("fetch", label):
+                    response = self._request(page_url, headers)
+            self.validator_cache.update(
+                page_url,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
+
+        with self.metrics.timer("parse", label):
+            page = self._load_page(response)
+        if self.metrics.enabled:
+            self.metrics.incr("bytes_downloaded", self._bytes_received(response), label)
+        return page
+
+    @staticmethod
+    def _bytes_received(response: requests.Response) -> int:
+        """
+        Get the number of bytes received for a response body, before decompression.
+
+        :param response: The response, with its body consumed.
+        :return: The number of bytes.
+        """
+        try:
+            return response.raw.tell()
+        except AttributeError:
+            return len(response.content)
+
+    def _iter_pages(
+        self,
+        page_url: str,
+        search: Dict[str, str],
+        max_pages: int,
+        page_num: int,
+        headers: Dict[str, str],
+    ) -> Iterator[Tuple[str, Any, Optional[str]]]:
+        """
+        Iterate over the pages of a search. The next page is fetched in the background
+        as soon as its URL is known, while the caller extracts elements from the current one.
+
+        :param page_url: The URL of the first page.
+        :param search: The search parameters.
+        :param max_pages: The maximum number of pages to process.
+        :param page_num: The page number of the first page.
+        :param headers: The request headers.
+        :return: An iterator of (page URL, page, next page URL) tuples.
+        """
+        executor = None
+        try:
+            page = self._fetch_page(page_url, headers, search)
+            while True:
+                next_page = None
+                if isinstance(page, NotModified):
+                    next_page_url = page.next_page
+                else:
+                    next_page_url = self._get_next_page(page, page_url)
+                if next_page_url:
+                    if page_num > max_pages:
+                        self.logger.error(
+                            f"Max page limit of {max_pages} reached without reaching end of search."
+                        )
+                        raise Exception(
+                            f"Max page limit of {max_pages} reached without reaching end of search. "
+                        )
+                    if executor is None:
+                        executor = ThreadPoolExecutor(
+                            max_workers=1, thread_name_prefix=f"{self.site_name}-prefetch"
+                        )
+                    next_page = executor.submit(
+                        self._fetch_page, next_page_url, headers, search
+                    )
+
+                yield page_url, page, next_page_url
+
+                if next_page is None:
+                    return
+                page_url, page = next_page_url, next_page.result()
+                page_num += 1
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
     def _process_page(
         self,
         page_url: str,
@@ -341,47 +981,45 @@ class Scraper(ABC):
         headers: Dict[str, str] = HEADERS,
     ) -> Dict[str, Any]:
         """
-        Process a page of results.
+        Process a page of results, and all following pages of the search.
 
         :param page_url: The URL of the page to process.
         :param elmnts_dict: The dictionary to store elements.
         :param search: The search parameters.
         :param max_pages: The maximum number of pages to process.
         :param page_num: The current page number.
-        :param json_request: Whether the request is for JSON data.
         :param headers: The request headers.
         :return: The updated elements dictionary.
         """
-        self.logger.info(f"Processing page: {page_url}")
-        if self.json_request:
-            page = requests.get(page_url, headers=headers).json()
-        else:
-            page = BROWSER.get(page_url, headers=headers).soup
-        elmnts = self._get_elements(page)
-
-        for e in elmnts:
-            elmnts_dict = self._get_attrs(e, elmnts_dict, search)
-
-        next_page_url = self._get_next_page(page, page_url)
-        if next_page_url:
-            if page_num > max_pages:
-                self.logger.error(
-                    f"Max page limit of {max_pages} reached without reaching end of search."
-                )
-                raise Exception(
-                    f"Max page limit of {max_pages} reached without reaching end of search. "
-                )
-            page_num += 1
-            self._process_page(
-                next_page_url,
-                elmnts_dict,
-                search,
-                max_pages,
-                page_num,
-                headers,
-            )
-
-        self.logger.info(f"Finished processing page: {page_url}")
+        label = search["search_title"]
+        pages = self._iter_pages(page_url, search, max_pages, page_num, headers)
+        with closing(pages):
+            for cur_url, page, next_page_url in pages:
+                self.logger.info(f"Processing page: {cur_url}")
+                if isinstance(page, NotModified):
+                    elmnts_dict.update(page.elements)
+                    self.logger.info(f"Finished processing page: {cur_url}")
+                    continue
+
+                num_elmnts = 0
+                with self.metrics.timer("extract", label):
+                    if self.validator_cache is None:
+                        for e in self._get_elements(page):
+                            elmnts_dict = self._get_attrs(e, elmnts_dict, search)
+                            num_elmnts += 1
+                    else:
+                        # Keep the elements of each page apart, to reuse them on a 304
+                        page_elmnts = {}
+                        for e in self._get_elements(page):
+                            page_elmnts = self._get_attrs(e, page_elmnts, search)
+                            num_elmnts += 1
+                        self.validator_cache.set_elements(
+                            cur_url, search, next_page_url, page_elmnts
+                        )
+                        elmnts_dict.update(page_elmnts)
+                self.metrics.incr("elements_extracted", num_elmnts, label)
+
+                self.logger.info(f"Finished processing page: {cur_url}")
         return elmnts_dict
 
     @abstractmethod
@@ -440,11 +1078,48 @@ class SiteChangedScraper(Scraper):
     A subclass of Scraper that checks whether html for a site has changed.
     """
 
+    MAX_PAGES = 1
+    # Whether the fingerprint can be taken from the raw response, without parsing it
+    FINGERPRINT_RAW = True
+
+    def __init__(self, *args, fingerprint: bool = False, **kwargs):
+        """
+        :param fingerprint: Store a SHA-256 digest of each page instead of its content.
+            Switching an existing setup to fingerprints triggers one change alert per page.
+        """
+        super().__init__(*args, **kwargs)
+        self.fingerprint = fingerprint
+
+    @property
+    def stream_responses(self) -> bool:
+        """
+        Stream responses when the fingerprint is taken from the raw body.
+
+        :return: Whether responses are streamed.
+        """
+        return self.fingerprint and self.FINGERPRINT_RAW
+
+    def _load_page(self, response: requests.Response) -> Any:
+        """
+        Decode a response. In raw fingerprint mode the body is hashed as it is downloaded,
+        and never parsed.
+
+        :param response: The response to decode.
+        :return: The digest of the body in raw fingerprint mode, else the decoded page.
+        """
+        if not self.stream_responses:
+            return super()._load_page(response)
+        digest = hashlib.sha256()
+        with response:
+            for chunk in response.iter_content(chunk_size=DIGEST_CHUNK_SIZE):
+                digest.update(chunk)
+        return f"sha256:{digest.hexdigest()}"
+
     def _get_elements(self, page: BeautifulSoup) -> List[Dict[str, Any]]:
         """
         Extract elements from a page. For this scraper, we will just return the entire page content.
 
-        :param page: The page to extract elements from.
+        :param page: The page to extract elements from, or its digest in fingerprint mode.
         :return: A list containing the page content.
         """
         return [{"content": str(page)}]
@@ -492,47 +1167,101 @@ class SiteChangedScraper(Scraper):
         """
         return f"Innhold på nettsiden {search_link} har blitt endret siden sist."
 
-    def _run_scraper(self):
-        """
-        Override the run_scraper method to check if the site has changed.
-        """
-        self.logger.info("Starting site change check function")
-
-        searches = self._i_o_setup()
-        cur_elements = {}
-
-        for search in searches:
-            cur_elements = self._process_page(
-                search["search_url"],
-                cur_elements,
-                search,
-                max_pages=1,
-                page_num=1,
-            )
-
-        new_elements = self._compare_results(cur_elements)
-
-        if new_elements:
-            self.logger.info(f"Found {len(new_elements)} new elements")
-            self._alert_write_new(
-                new_elements,
-                searches,
-            )
-
-        self.logger.info("Finished site change check function")
-
 
 class SiteTextChangedScraper(SiteChangedScraper):
     """
     A subclass of SiteTextChangedScraper that checks if text has changed on a site.
     """
 
-    def _get_elements(self, page: BeautifulSoup) -> List[Dict[str, str]]:
+    FINGERPRINT_RAW = False
+    # Limits for the changed text quoted in notifications
+    MAX_QUOTED_CHUNKS = 3
+    MAX_QUOTED_CHARS = 300
+
+    def __init__(
+        self,
+        *args,
+        chunked_diff: bool = False,
+        volatile_patterns: Optional[List[str]] = None,
+        **kwargs,
+    ):
+        """
+        :param chunked_diff: Store hashes of normalized text chunks instead of the text, and
+            report which sections were added or removed. Takes precedence over fingerprint.
+        :param volatile_patterns: Regular expressions for text to ignore in chunked mode,
+            like timestamps or visitor counters.
+        """
+        super().__init__(*args, **kwargs)
+        self.chunked_diff = chunked_diff
+        self.volatile_patterns = text_diff.compile_patterns(volatile_patterns or [])
+        self._text_changes: Dict[str, text_diff.TextChanges] = {}
+
+    def _get_elements(self, page: BeautifulSoup) -> List[Dict[str, Any]]:
         """
         Extract elements from a page. For this scraper, we will return the text on a site.
         Useful to avoid triggering notification because of dynamically changing html content.
 
         :param page: The page to extract elements from.
-        :return: A list containing the page content.
+        :return: A list containing the page content, its digest in fingerprint mode, or
+            its chunk hashes in chunked mode.
         """
+        if self.chunked_diff:
+            hashes, chunks = text_diff.chunk_text(page.text, self.volatile_patterns)
+            return [{"content": hashes, "chunks": chunks}]
+        if self.fingerprint:
+            digest = hashlib.sha256(page.text.encode()).hexdigest()
+            return [{"content": f"sha256:{digest}"}]
         return [{"content": page.text}]
+
+    def _get_attrs(
+        self, element: Any, elmnts_dict: Dict[str, Any], search: Dict[str, str]
+    ) -> Dict[str, Any]:
+        """
+        Extract attributes from an element. In chunked mode, the chunks are compared with
+        the stored chunk hashes, and only the hashes are kept in the element.
+
+        :param element: The element to extract attributes from.
+        :param elmnts_dict: The dictionary to store attributes.
+        :param search: The search parameters.
+        :return: The updated attributes dictionary.
+        """
+        chunks = element.pop("chunks", None)
+        if chunks is not None:
+            search_url = search["search_url"]
+            prev = self.element_store.get_many([search_url]).get(search_url)
+            prev_hashes = prev.get("content") if isinstance(prev, dict) else None
+            # Nothing to quote for pages seen for the first time, or stored in another mode
+            if isinstance(prev_hashes, list):
+                self._text_changes[search_url] = text_diff.compare(
+                    prev_hashes, element["content"], chunks
+                )
+            else:
+                self._text_changes.pop(search_url, None)
+        return super()._get_attrs(element, elmnts_dict, search)
+
+    def _ad_string_format(
+        self, offer_link: str, search_link: str, offer_dict: Dict[str, Any]
+    ) -> str:
+        """
+        Format the ad string for an offer. In chunked mode, quote the added text and count
+        the removed sections.
+
+        :param offer_link: The offer link.
+        :param search_link: The search link.
+        :param offer_dict: The offer dictionary.
+        :return: The formatted ad string.
+        """
+        text = super()._ad_string_format(offer_link, search_link, offer_dict)
+        changes = self._text_changes.get(offer_dict["search"]["search_url"])
+        if not changes:
+            return text
+
+        for added in changes.added[: self.MAX_QUOTED_CHUNKS]:
+            if len(added) > self.MAX_QUOTED_CHARS:
+                added = added[: self.MAX_QUOTED_CHARS] + " …"
+            text += f"\n\nNytt:\n{added}"
+        if len(changes.added) > self.MAX_QUOTED_CHUNKS:
+            text += f"\n\n... og {len(changes.added) - self.MAX_QUOTED_CHUNKS} nye avsnitt til."
+        if changes.removed:
+            text += f"\n\n{changes.removed} avsnitt er fjernet."
+        return text
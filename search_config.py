@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from i_o_utilities import create_files, write_json_atomic
+
+DEFAULT_CACHE_FILE = "./data/searches_cache.json"
+# Bump when the compiled form changes, to invalidate cached entries
+COMPILED_VERSION = 1
+
+
+class InvalidSearchConfig(Exception):
+    """Raised when a searches file holds invalid search definitions."""
+
+    pass
+
+
+def is_valid_url(url: Any) -> bool:
+    """
+    Check if a URL is valid.
+
+    :param url: The URL to check.
+    :return: True if the URL has a scheme and a host, False otherwise.
+    """
+    try:
+        result = urlparse(url)
+        return all([result.scheme, result.netloc])
+    except (ValueError, TypeError, AttributeError):
+        return False
+
+
+def compile_searches(search_data: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Validate parsed search definitions, and turn them into the search parameters used by
+    the scrapers.
+
+    :param search_data: The parsed content of a searches file.
+    :return: A list of search parameters.
+    :raise InvalidSearchConfig: If a search has an invalid URL.
+    """
+    searches = []
+    for search in (search_data or {}).get("searches") or []:
+        search_url = search.get("search_url")
+        # Set to search_url if display_url is not provided
+        display_url = search.get("display_url", search_url)
+        if not is_valid_url(search_url) or not is_valid_url(display_url):
+            raise InvalidSearchConfig(f"Invalid URL(s) found: {search_url}, {display_url}")
+
+        search_params = {
+            "search_url": search_url,
+            "display_url": display_url,
+            "search_title": search.get("title"),
+        }
+        # Seconds between runs of the search in daemon mode
+        if search.get("interval") is not None:
+            search_params["interval"] = float(search["interval"])
+        searches.append(search_params)
+    return searches
+
+
+def parse_yaml(content: bytes) -> Any:
+    """
+    Parse YAML, with the C loader of PyYAML if it is available.
+
+    :param content: The YAML document.
+    :return: The parsed document.
+    """
+    import yaml
+
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return yaml.load(content, Loader=loader)
+
+
+class SearchConfigCache:
+    """
+    Loads searches files, keeping their compiled search parameters in memory and in a JSON
+    cache file. A file is only read again when its mtime or size changes, and only parsed
+    again when its content hash changes. Loading on every run therefore picks up edits
+    without a restart, at the cost of a stat call when nothing has changed.
+    """
+
+    def __init__(
+        self,
+        cache_file: Optional[str] = DEFAULT_CACHE_FILE,
+        logger: logging.Logger = logging.getLogger(__name__),
+    ):
+        """
+        :param cache_file: Path to the JSON cache file, shared by all searches files. Nothing
+            is persisted if None.
+        :param logger: Logger instance.
+        """
+        self.cache_file = cache_file
+        self.logger = logger
+        # Absolute path -> cache entry, with stat key, hash and compiled searches
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._disk_loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat_key(path: str) -> Tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read_disk(self) -> Dict[str, Dict[str, Any]]:
+        if not self.cache_file:
+            return {}
+        create_files(self.cache_file)
+        with open(self.cache_file, "r") as fp:
+            content = fp.read()
+        try:
+            entries = json.loads(content) if content else {}
+        except ValueError:
+            # A broken cache only costs one parse of each searches file
+            self.logger.warning("Could not read searches cache. Starting empty.")
+            return {}
+        return {
+            path: entry
+            for path, entry in entries.items()
+            if entry.get("version") == COMPILED_VERSION
+        }
+
+    def _write_disk(self, path: str, entry: Dict[str, Any]):
+        if not self.cache_file:
+            return
+        # Other processes may share the cache file, so merge with what is on disk now
+        entries = self._read_disk()
+        entries[path] = entry
+        try:
+            write_json_atomic(self.cache_file, entries)
+        except OSError as e:
+            self.logger.warning(f"Could not write searches cache: {e}")
+
+    def load(self, filename: str) -> List[Dict[str, Any]]:
+        """
+        Load the search parameters of a searches file.
+
+        :param filename: Path to the searches YAML file.
+        :return: A list of search parameters.
+        :raise FileNotFoundError: If the file does not exist.
+        :raise InvalidSearchConfig: If a search has an invalid URL.
+        """
+        path = os.path.abspath(os.path.expanduser(filename))
+        with self._lock:
+            stat_key = list(self._stat_key(path))
+            entry = self._entries.get(path)
+            if entry is None and not self._disk_loaded:
+                self._entries.update(self._read_disk())
+                self._disk_loaded = True
+                entry = self._entries.get(path)
+
+            if entry is None or entry["stat"] != stat_key:
+                with open(path, "rb") as fp:
+                    content = fp.read()
+                digest = hashlib.sha256(content).hexdigest()
+                if entry is None or entry["sha256"] != digest:
+                    if entry is not None:
+                        self.logger.info(f"Searches file changed, reloading {filename}")
+                    searches = compile_searches(parse_yaml(content))
+                else:
+                    # Touched, but not changed
+                    searches = entry["searches"]
+                entry = {
+                    "version": COMPILED_VERSION,
+                    "stat": stat_key,
+                    "sha256": digest,
+                    "searches": searches,
+                }
+                self._entries[path] = entry
+                self._write_disk(path, entry)
+
+            return [dict(search) for search in entry["searches"]]
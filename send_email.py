@@ -1,60 +1,441 @@
+import base64
+import gzip
+import logging
+import mimetypes
 import smtplib
 import ssl
 import os
+import tempfile
+import threading
+import time
+from email import policy
+from email.message import EmailMessage
 from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
+from email.utils import make_msgid
 
 
-def send_email(
+SMTP_SERVER = "smtp.gmail.com"
+SMTP_PORT = 465  # For SSL
+SIZE_LIMIT = 25 * 1024 * 1024  # 25MB in bytes
+# Implicit TLS, STARTTLS, or no encryption (for local stand-ins)
+TLS_MODES = ("ssl", "starttls", "none")
+# Seconds a connection may be idle before it is checked with NOOP
+NOOP_AFTER = 10
+# Attachments are read, compressed and sent in chunks of this size
+CHUNK_SIZE = 64 * 1024
+# Attachment data is kept in memory up to this size, and on disk beyond it
+SPOOL_SIZE = 1024 * 1024
+# Bytes per base64 line: 57 bytes encode to a 76 character line
+BASE64_LINE_BYTES = 57
+# Attachments compressed when compress is None ("auto")
+COMPRESSIBLE_EXTENSIONS = (".log", ".txt", ".csv", ".json", ".yaml", ".yml", ".html", ".xml")
+
+
+class _Base64Writer:
+    """
+    File-like sink encoding the bytes written to it as base64 lines into another file.
+    Counts the bytes written, before encoding.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.size = 0
+        self._buffer = b""
+
+    def write(self, data):
+        self.size += len(data)
+        data = self._buffer + data
+        # Encode whole lines only, and keep the rest for the next write
+        end = len(data) - len(data) % BASE64_LINE_BYTES
+        for i in range(0, end, BASE64_LINE_BYTES):
+            self.target.write(base64.b64encode(data[i : i + BASE64_LINE_BYTES]) + b"\r\n")
+        self._buffer = data[end:]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buffer:
+            self.target.write(base64.b64encode(self._buffer) + b"\r\n")
+            self._buffer = b""
+
+
+class StreamedMessage:
+    """
+    A MIME message with its attachments encoded into a spooled temporary file, kept in
+    memory up to SPOOL_SIZE bytes and on disk beyond that. The message is read back in
+    chunks when it is sent, so it is never held in memory as a whole.
+    """
+
+    def __init__(self, head, attachments, boundary):
+        """
+        :param head: The headers and the text part.
+        :param attachments: The spooled file holding the encoded attachment parts.
+        :param boundary: The multipart boundary.
+        """
+        self.head = head
+        self.attachments = attachments
+        self.tail = f"--{boundary}--\r\n".encode()
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        Read the serialized message.
+
+        :param chunk_size: The size of the chunks of attachment data.
+        :return: An iterator of byte chunks, with CRLF line endings.
+        """
+        yield self.head
+        self.attachments.seek(0)
+        while True:
+            chunk = self.attachments.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        yield self.tail
+
+    def as_bytes(self):
+        return b"".join(self.chunks())
+
+    def as_string(self):
+        return self.as_bytes().decode("ascii")
+
+    def close(self):
+        self.attachments.close()
+
+
+def _header_bytes(message):
+    """
+    Serialize only the headers of a message, followed by the blank line ending them.
+    """
+    return (
+        b"".join(policy.SMTP.fold_binary(name, value) for name, value in message.items())
+        + b"\r\n"
+    )
+
+
+def _should_compress(filename, compress):
+    if compress is None:
+        return filename.lower().endswith(COMPRESSIBLE_EXTENSIONS)
+    return compress
+
+
+def _write_attachment(fp, path, compress):
+    """
+    Write an attachment part to a file, streaming the file from disk through optional gzip
+    compression and base64 encoding.
+
+    :return: The size of the attached data, after compression.
+    """
+    name = os.path.basename(path)
+    if compress:
+        name += ".gz"
+        content_type = "application/gzip"
+    else:
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    part = EmailMessage(policy=policy.SMTP)
+    part["Content-Type"] = content_type
+    part.set_param("name", name)
+    part["Content-Transfer-Encoding"] = "base64"
+    part.add_header("Content-Disposition", "attachment", filename=name)
+    fp.write(_header_bytes(part))
+
+    encoder = _Base64Writer(fp)
+    with open(path, "rb") as source:
+        if compress:
+            with gzip.GzipFile(filename=os.path.basename(path), mode="wb", fileobj=encoder, mtime=0) as gz:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    gz.write(chunk)
+        else:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                encoder.write(chunk)
+    encoder.close()
+    return encoder.size
+
+
+def build_message(
     receiver_email,
     subject,
     text,
     *files,
     sender_email,
-    password,
     html=False,
+    compress=None,
 ):
-    port = 465  # For SSL
-    smtp_server = "smtp.gmail.com"
-    size_limit = 25 * 1024 * 1024  # 25MB in bytes
+    """
+    Build an email, with files attached. Attachments are streamed from disk, and text and
+    log files can be gzip compressed on the way. Files larger than SIZE_LIMIT after
+    compression are left out, with a note in the text.
 
-    message = MIMEMultipart()
-    message["Subject"] = subject
-    message["From"] = sender_email
-    message["To"] = receiver_email
-
-    # Add the main text to the email
-    mime_type = "html" if html else "plain"
-    message.attach(MIMEText(text, mime_type))
+    :param compress: Whether to gzip attachments. If None, only text and log files are.
+    :return: The message, as a StreamedMessage.
+    """
+    boundary = f"=={make_msgid(domain='mail').strip('<>').replace('@', '.')}"
+    attachments = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode="w+b")
 
     # Check file sizes and attach files if they are within the size limit
     if files and files != (None,):
-        # Ensure there is a newline before attaching files
         for f in files:
             f = os.path.expanduser(f)
-            try:
-                file_size = os.path.getsize(f)
-                if file_size > size_limit:
-                    size_in_mb = file_size / (1024 * 1024)
-                    text += f"\n\nFile '{os.path.basename(f)}' ({size_in_mb:.2f} MB) was not sent due to size limit."
-                    continue
-
-                with open(f, "rb") as fil:
-                    part = MIMEApplication(fil.read(), Name=os.path.basename(f))
-            except FileNotFoundError as e:
+            if not os.path.isfile(f):
+                attachments.close()
                 raise FileNotFoundError("Invalid file specified.")
-            # After the file is closed
-            part["Content-Disposition"] = (
-                'attachment; filename="%s"' % os.path.basename(f)
+            start = attachments.tell()
+            attachments.write(f"--{boundary}\r\n".encode())
+            size = _write_attachment(attachments, f, _should_compress(f, compress))
+            if size > SIZE_LIMIT:
+                # Drop the part again
+                attachments.seek(start)
+                attachments.truncate()
+                size_in_mb = size / (1024 * 1024)
+                text += f"\n\nFile '{os.path.basename(f)}' ({size_in_mb:.2f} MB) was not sent due to size limit."
+
+    # The text part comes first, but is written last, to include the size limit notes
+    headers = EmailMessage(policy=policy.SMTP)
+    headers["Subject"] = subject
+    headers["From"] = sender_email
+    headers["To"] = receiver_email
+    headers["MIME-Version"] = "1.0"
+    headers["Content-Type"] = f'multipart/mixed; boundary="{boundary}"'
+    mime_type = "html" if html else "plain"
+    text_part = MIMEText(text, mime_type, "utf-8")
+    del text_part["MIME-Version"]
+    head = (
+        _header_bytes(headers)
+        + f"--{boundary}\r\n".encode()
+        + text_part.as_bytes(policy=policy.SMTP)
+        + b"\r\n"
+    )
+    return StreamedMessage(head, attachments, boundary)
+
+
+class Mailer:
+    """
+    SMTP client keeping one authenticated connection open between sends. The SSL context is
+    created once, and the login is done once per connection. Before a connection that has
+    been idle is reused, it is checked with NOOP, and replaced if the server has dropped it.
+
+    Usage:
+        with Mailer(sender_email, password) as mailer:
+            mailer.send_many([(receiver_email, message), ...])
+    """
+
+    def __init__(
+        self,
+        sender_email,
+        password=None,
+        host=SMTP_SERVER,
+        port=SMTP_PORT,
+        tls="ssl",
+        timeout=30,
+        logger=logging.getLogger(__name__),
+    ):
+        """
+        :param sender_email: The account to send from.
+        :param password: The password of the account. No login if None.
+        :param host: The SMTP server.
+        :param port: The SMTP port.
+        :param tls: "ssl" for implicit TLS, "starttls", or "none".
+        :param timeout: Socket timeout in seconds.
+        :param logger: Logger instance.
+        """
+        if tls not in TLS_MODES:
+            raise ValueError(f"Unknown TLS mode '{tls}', expected one of {TLS_MODES}")
+        self.sender_email = sender_email
+        self.password = password
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.timeout = timeout
+        self.logger = logger
+        self.connections = 0
+        self._context = None
+        self._server = None
+        self._last_used = 0.0
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self.tls != "none" and self._context is None:
+            self._context = ssl.create_default_context()
+        if self.tls == "ssl":
+            server = smtplib.SMTP_SSL(
+                self.host, self.port, timeout=self.timeout, context=self._context
             )
-            message.attach(part)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.tls == "starttls":
+                server.starttls(context=self._context)
+        try:
+            if self.password is not None:
+                server.login(self.sender_email, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.connections += 1
+        self.logger.debug(f"Connected to {self.host}:{self.port}")
+        return server
+
+    def _is_alive(self):
+        try:
+            code, _ = self._server.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        return code == 250
+
+    def _connection(self):
+        """
+        Get an open connection, connecting if there is none or the current one is dead.
+        """
+        if self._server is not None and time.monotonic() - self._last_used > NOOP_AFTER:
+            if not self._is_alive():
+                self.logger.debug("SMTP connection lost, reconnecting")
+                self._drop()
+        if self._server is None:
+            self._server = self._connect()
+        return self._server
+
+    def _drop(self):
+        if self._server is not None:
+            try:
+                self._server.close()
+            finally:
+                self._server = None
+
+    def send(self, receiver_email, message):
+        """
+        Send a message.
+
+        :param receiver_email: The recipient.
+        :param message: The message, from build_message.
+        """
+        errors = self.send_many([(receiver_email, message)])
+        if errors:
+            raise errors[0]
+
+    def send_many(self, messages):
+        """
+        Send messages over the open connection. A connection dropped by the server during the
+        batch is reopened, and the message it failed on is sent again.
+
+        :param messages: (receiver email, message) pairs, with messages from build_message.
+        :return: The errors of messages the server refused, by index in `messages`.
+        :raise smtplib.SMTPException: If the server can not be connected or logged in to.
+        """
+        errors = {}
+        with self._lock:
+            for index, (receiver_email, message) in enumerate(messages):
+                for attempt in range(2):
+                    server = self._connection()
+                    try:
+                        if isinstance(message, StreamedMessage):
+                            self._send_streamed(server, receiver_email, message)
+                        else:
+                            server.sendmail(
+                                self.sender_email, receiver_email, message.as_string()
+                            )
+                    except smtplib.SMTPServerDisconnected:
+                        self._drop()
+                        if attempt:
+                            raise
+                        continue
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as e:
+                        # Refused by the server: the connection is still usable
+                        self.logger.error(f"Email to {receiver_email} refused: {e}")
+                        errors[index] = e
+                    finally:
+                        self._last_used = time.monotonic()
+                    break
+        return errors
+
+    def _send_streamed(self, server, receiver_email, message):
+        """
+        Send a StreamedMessage, writing it to the socket chunk by chunk instead of building
+        the whole DATA payload first, as smtplib's sendmail does.
+        """
+        server.ehlo_or_helo_if_needed()
+        code, response = server.mail(self.sender_email)
+        if code != 250:
+            server.rset()
+            raise smtplib.SMTPSenderRefused(code, response, self.sender_email)
+        code, response = server.rcpt(receiver_email)
+        if code not in (250, 251):
+            server.rset()
+            raise smtplib.SMTPRecipientsRefused({receiver_email: (code, response)})
+        server.putcmd("data")
+        code, response = server.getreply()
+        if code != 354:
+            server.rset()
+            raise smtplib.SMTPDataError(code, response)
+
+        line_start = True
+        for chunk in message.chunks():
+            # Dot-stuff lines starting with a period, also across chunk boundaries
+            chunk = chunk.replace(b"\n.", b"\n..")
+            if line_start and chunk.startswith(b"."):
+                chunk = b"." + chunk
+            line_start = chunk.endswith(b"\n")
+            server.send(chunk)
+        server.send(b".\r\n" if line_start else b"\r\n.\r\n")
+        code, response = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+
+    def close(self):
+        """
+        Log out and close the connection.
+        """
+        with self._lock:
+            if self._server is not None:
+                try:
+                    self._server.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self._drop()
 
-    # Create secure connection with server and send email
-    context = ssl.create_default_context()
-    with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
-        server.login(sender_email, password)
-        server.sendmail(sender_email, receiver_email, message.as_string())
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def send_emails(messages, sender_email, password):
+    """
+    Send messages over one connection, logging in once.
+
+    :param messages: (receiver email, message) pairs, with messages from build_message.
+    :param sender_email: The account to send from.
+    :param password: The password of the account.
+    """
+    with Mailer(sender_email, password) as mailer:
+        errors = mailer.send_many(messages)
+    if errors:
+        raise next(iter(errors.values()))
+
+
+def send_email(
+    receiver_email,
+    subject,
+    text,
+    *files,
+    sender_email,
+    password,
+    html=False,
+    compress=None,
+):
+    message = build_message(
+        receiver_email,
+        subject,
+        text,
+        *files,
+        sender_email=sender_email,
+        html=html,
+        compress=compress,
+    )
+    try:
+        send_emails([(receiver_email, message)], sender_email, password)
+    finally:
+        message.close()
 
 
 if __name__ == "__main__":
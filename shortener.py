@@ -0,0 +1,186 @@
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from i_o_utilities import create_files, write_json_atomic
+
+DEFAULT_CACHE_FILE = "./data/short_urls.json"
+DEFAULT_TTL_DAYS = 90
+DEFAULT_MAX_ENTRIES = 5000
+
+
+class ShortenerBackend(ABC):
+    """
+    An abstract base class for URL shortening services.
+    """
+
+    @abstractmethod
+    def short(self, url: str) -> str:
+        """
+        Shorten a URL.
+
+        :param url: The URL to shorten.
+        :return: The short URL.
+        """
+        pass
+
+
+class TinyUrlBackend(ShortenerBackend):
+    """
+    Shortens URLs with TinyURL, through pyshorteners.
+    """
+
+    def __init__(self, timeout: int = 10):
+        """
+        :param timeout: Request timeout in seconds.
+        """
+        import pyshorteners
+
+        self._shortener = pyshorteners.Shortener(timeout=timeout)
+
+    def short(self, url: str) -> str:
+        return self._shortener.tinyurl.short(url)
+
+
+class IdentityBackend(ShortenerBackend):
+    """
+    Local stand-in for a shortening service, returning URLs unchanged.
+    """
+
+    def short(self, url: str) -> str:
+        return url
+
+
+class UrlShortener:
+    """
+    Shortens URLs through a backend, with a persistent cache of earlier results. Cache misses
+    are resolved concurrently. Entries expire after `ttl_days`, and the least recently used
+    entries are evicted when the cache grows beyond `max_entries`.
+    """
+
+    def __init__(
+        self,
+        cache_file: Optional[str] = DEFAULT_CACHE_FILE,
+        backend: Optional[ShortenerBackend] = None,
+        ttl_days: float = DEFAULT_TTL_DAYS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_workers: int = 8,
+        logger: logging.Logger = logging.getLogger(__name__),
+    ):
+        """
+        :param cache_file: Path to the JSON cache file. Nothing is persisted if None.
+        :param backend: The shortening service. Defaults to TinyURL, set up on first use.
+        :param ttl_days: Days before a cached short URL is requested again.
+        :param max_entries: Maximum number of cached URLs.
+        :param max_workers: Maximum number of concurrent requests to the backend.
+        :param logger: Logger instance.
+        """
+        self.cache_file = cache_file
+        self._backend = backend
+        self.ttl = ttl_days * 24 * 3600
+        self.max_entries = max_entries
+        self.max_workers = max_workers
+        self.logger = logger
+        self.backend_calls = 0
+        # url -> [short url, created timestamp, last used timestamp]
+        self._cache: Optional[Dict[str, List]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> ShortenerBackend:
+        """
+        The shortening service, created on first use, so runs that shorten nothing do not load it.
+
+        :return: The backend.
+        """
+        with self._lock:
+            if self._backend is None:
+                self._backend = TinyUrlBackend()
+            return self._backend
+
+    def _load(self) -> Dict[str, List]:
+        if self._cache is None:
+            self._cache = {}
+            if self.cache_file:
+                create_files(self.cache_file)
+                with open(self.cache_file, "r") as fp:
+                    content = fp.read()
+                try:
+                    self._cache = json.loads(content) if content else {}
+                except ValueError:
+                    self.logger.warning("Could not read short URL cache. Starting empty.")
+        return self._cache
+
+    def _resolve(self, url: str) -> str:
+        with self._lock:
+            self.backend_calls += 1
+        try:
+            return self.backend.short(url)
+        except Exception as e:
+            self.logger.warning(f"Could not shorten {url}, using it as is: {e}")
+            return url
+
+    def short_many(self, urls: Iterable[str]) -> Dict[str, str]:
+        """
+        Shorten URLs, requesting only those not in the cache.
+
+        :param urls: The URLs to shorten.
+        :return: The short URL for each URL. A URL that could not be shortened maps to itself.
+        """
+        now = time.time()
+        result = {}
+        misses = []
+        with self._lock:
+            cache = self._load()
+            for url in dict.fromkeys(urls):
+                entry = cache.get(url)
+                if entry and now - entry[1] < self.ttl:
+                    entry[2] = now
+                    result[url] = entry[0]
+                else:
+                    misses.append(url)
+
+        if misses:
+            self.logger.debug(f"Shortening {len(misses)} URLs not in cache")
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(misses))
+            ) as executor:
+                short_urls = list(executor.map(self._resolve, misses))
+            with self._lock:
+                for url, short_url in zip(misses, short_urls):
+                    result[url] = short_url
+                    if short_url != url:
+                        self._cache[url] = [short_url, now, now]
+        return result
+
+    def short(self, url: str) -> str:
+        """
+        Shorten a URL.
+
+        :param url: The URL to shorten.
+        :return: The short URL, or the URL itself if it could not be shortened.
+        """
+        return self.short_many([url])[url]
+
+    def save(self):
+        """
+        Write the cache to disk, dropping expired and least recently used entries.
+        """
+        with self._lock:
+            if self._cache is None or not self.cache_file:
+                return
+            now = time.time()
+            entries = [
+                (url, entry)
+                for url, entry in self._cache.items()
+                if now - entry[1] < self.ttl
+            ]
+            if len(entries) > self.max_entries:
+                entries.sort(key=lambda item: item[1][2], reverse=True)
+                entries = entries[: self.max_entries]
+            self._cache = dict(entries)
+            write_json_atomic(self.cache_file, self._cache)
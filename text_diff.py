@@ -0,0 +1,109 @@
+import hashlib
+import re
+import zlib
+from typing import Iterable, List, NamedTuple, Pattern, Sequence, Tuple
+
+# A chunk ends after a line whose checksum is divisible by CHUNK_DIVISOR, giving chunks of
+# CHUNK_DIVISOR lines on average. Since the boundaries depend on content only, an edit
+# only changes the chunks around it.
+CHUNK_DIVISOR = 4
+MAX_CHUNK_LINES = 32
+WHITESPACE = re.compile(r"\s+")
+
+
+class TextChanges(NamedTuple):
+    added: List[str]
+    removed: int
+
+
+def compile_patterns(patterns: Iterable[str]) -> List[Pattern]:
+    """
+    Compile patterns for volatile content.
+
+    :param patterns: Regular expressions matching content to ignore, like dates or counters.
+    :return: The compiled patterns.
+    """
+    return [re.compile(pattern) for pattern in patterns]
+
+
+def normalize(text: str, volatile_patterns: Sequence[Pattern] = ()) -> List[str]:
+    """
+    Normalize text into lines, with volatile content removed and whitespace collapsed.
+
+    :param text: The text to normalize.
+    :param volatile_patterns: Compiled patterns of content to remove.
+    :return: The non-empty normalized lines.
+    """
+    lines = []
+    for line in text.splitlines():
+        for pattern in volatile_patterns:
+            line = pattern.sub("", line)
+        line = WHITESPACE.sub(" ", line).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def chunk(lines: Sequence[str]) -> List[str]:
+    """
+    Split lines into content-defined chunks.
+
+    :param lines: The normalized lines.
+    :return: The chunks, as text.
+    """
+    chunks = []
+    start = 0
+    for i, line in enumerate(lines):
+        end = i + 1
+        if (
+            zlib.crc32(line.encode()) % CHUNK_DIVISOR == 0
+            or end - start >= MAX_CHUNK_LINES
+        ):
+            chunks.append("\n".join(lines[start:end]))
+            start = end
+    if start < len(lines):
+        chunks.append("\n".join(lines[start:]))
+    return chunks
+
+
+def chunk_hash(text: str) -> str:
+    """
+    Hash a chunk.
+
+    :param text: The chunk text.
+    :return: A 64 bit hex digest.
+    """
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def chunk_text(
+    text: str, volatile_patterns: Sequence[Pattern] = ()
+) -> Tuple[List[str], List[str]]:
+    """
+    Normalize and chunk text.
+
+    :param text: The text.
+    :param volatile_patterns: Compiled patterns of content to ignore.
+    :return: The chunk hashes, and the chunks they belong to.
+    """
+    chunks = chunk(normalize(text, volatile_patterns))
+    return [chunk_hash(c) for c in chunks], chunks
+
+
+def compare(
+    prev_hashes: Sequence[str], cur_hashes: Sequence[str], cur_chunks: Sequence[str]
+) -> TextChanges:
+    """
+    Compare the chunks of a text with the chunk hashes of an earlier version.
+
+    :param prev_hashes: The chunk hashes of the earlier version.
+    :param cur_hashes: The chunk hashes of the current version.
+    :param cur_chunks: The chunks of the current version.
+    :return: The added chunks, and the number of removed chunks.
+    """
+    prev = set(prev_hashes)
+    cur = set(cur_hashes)
+    added = [
+        text for hash_, text in zip(cur_hashes, cur_chunks) if hash_ not in prev
+    ]
+    return TextChanges(added, len(prev - cur))
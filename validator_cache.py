@@ -0,0 +1,138 @@
+import json
+import threading
+from typing import Any, Dict, Optional
+
+from i_o_utilities import create_files, write_json_atomic
+
+
+class NotModified:
+    """
+    Stand-in for a page the server answered with 304 Not Modified. Holds what was
+    extracted from the page the last time it was downloaded.
+    """
+
+    def __init__(self, url: str, entry: Dict[str, Any]):
+        """
+        :param url: The URL of the page.
+        :param entry: The validator cache entry for the page.
+        """
+        self.url = url
+        self.elements = entry["elements"]
+        self.next_page = entry.get("next_page")
+
+
+class ValidatorCache:
+    """
+    Persistent per-URL store of HTTP validators (ETag / Last-Modified), together with
+    the elements extracted from the page they validate. Used to send conditional GETs,
+    and to reuse the extracted elements when the server answers 304.
+    """
+
+    def __init__(self, filename: str):
+        """
+        :param filename: Path to the JSON file holding the cache.
+        """
+        self.filename = filename
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._touched = set()
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            create_files(self.filename)
+            with open(self.filename, "r") as fp:
+                content = fp.read()
+            try:
+                self._entries = json.loads(content) if content else {}
+            except ValueError:
+                # A broken cache only costs one full download of every page
+                self._entries = {}
+        return self._entries
+
+    def conditional_headers(self, url: str, search: Dict[str, str]) -> Dict[str, str]:
+        """
+        Get the conditional request headers for a URL.
+
+        :param url: The URL to be requested.
+        :param search: The search the URL belongs to. Cached elements from another search are not reused.
+        :return: If-None-Match / If-Modified-Since headers, or an empty dict if there is no usable entry.
+        """
+        with self._lock:
+            entry = self._load().get(url)
+        if not entry or "elements" not in entry or entry.get("search") != search:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def not_modified(self, url: str) -> Optional[NotModified]:
+        """
+        Get the cached page for a URL answered with 304.
+
+        :param url: The requested URL.
+        :return: The cached page, or None if the entry has been replaced in the meantime.
+        """
+        with self._lock:
+            entry = self._load().get(url)
+            if not entry or "elements" not in entry:
+                return None
+            self._touched.add(url)
+            return NotModified(url, entry)
+
+    def update(self, url: str, etag: Optional[str], last_modified: Optional[str]):
+        """
+        Record the validators of a fresh response. Elements cached for the URL are dropped
+        until `set_elements` is called for the new content.
+
+        :param url: The requested URL.
+        :param etag: The ETag response header.
+        :param last_modified: The Last-Modified response header.
+        """
+        with self._lock:
+            entries = self._load()
+            self._touched.add(url)
+            if etag or last_modified:
+                entries[url] = {"etag": etag, "last_modified": last_modified}
+            else:
+                entries.pop(url, None)
+
+    def set_elements(
+        self,
+        url: str,
+        search: Dict[str, str],
+        next_page: Optional[str],
+        elements: Dict[str, Any],
+    ):
+        """
+        Store the elements extracted from a page fetched with `update`.
+
+        :param url: The page URL.
+        :param search: The search the page belongs to.
+        :param next_page: The URL of the next page, if any.
+        :param elements: The elements extracted from the page.
+        """
+        with self._lock:
+            entry = self._load().get(url)
+            if entry is not None and "elements" not in entry:
+                entry.update(search=search, next_page=next_page, elements=elements)
+
+    def save(self, prune: bool = True):
+        """
+        Write the cache to disk.
+
+        :param prune: Drop entries for URLs not requested since the cache was loaded.
+        """
+        with self._lock:
+            if self._entries is None:
+                return
+            if prune:
+                self._entries = {
+                    url: entry
+                    for url, entry in self._entries.items()
+                    if url in self._touched
+                }
+            write_json_atomic(self.filename, self._entries)
+            self._touched = set()